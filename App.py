@@ -1,23 +1,28 @@
 from kivy.config import Config
 Config.set('input', 'mouse', 'mouse,disable_multitouch')
-import json
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.properties import ObjectProperty
+from kivy.clock import Clock
 from kivy.core.window import Window
 from kivy.lang import Builder
 
 import time
 import os
+import threading
 
 import NoteEditor # он нужен, хоть и неявно
 import Dialogs
+import note_storage
+import search_index
+import summary_cache
 
 import os
 os.environ['KIVY_NO_ARGS'] = '1'  # Отключает аргументы Kivy
 
 class MainPanel(BoxLayout):
     vault_dir = 'my_vault'
+    index_refresh_interval = 60  # секунды между проверками изменений файлов хранилища
     file_chooser = ObjectProperty(None)
     note_editor = ObjectProperty(None)
 
@@ -25,11 +30,35 @@ class MainPanel(BoxLayout):
         super().__init__(**kwargs)
         if not os.path.exists(self.vault_dir):
             os.makedirs(self.vault_dir)
+        # Индекс (pickle) и кэш суммаризаций хранятся в папке данных приложения, а не в хранилище заметок.
+        # Загрузка и первое построение индекса идут в фоне, чтобы окно открывалось сразу
+        data_dir = App.get_running_app().user_data_dir
+        self.search_index = search_index.VaultIndex(self.vault_dir, index_dir=data_dir, build=False)
+        self._index_task = threading.Thread(target=self.search_index.open, daemon=True)
+        self._index_task.start()
+        self.note_editor.search_index = self.search_index
+        self.summary_cache = summary_cache.SummaryCache(data_dir)
+        self.note_editor.summarizator.cache = self.summary_cache
+        Clock.schedule_interval(self.refresh_search_index, self.index_refresh_interval)
         self.file_chooser.path = self.vault_dir
         # Разрешаем отображать .json
         self.file_chooser.filters = ['*.json']
         self.file_chooser._update_files()
 
+    def refresh_search_index(self, dt=None):
+        """
+        Подхватывает изменения заметок, сделанные вне приложения, и сохраняет индекс
+        (если он изменился). Обход хранилища и запись идут в фоновом потоке
+        """
+        if self._index_task.is_alive():
+            return  # индекс еще строится или предыдущая проверка не закончилась
+        self._index_task = threading.Thread(target=self._refresh_search_index_in_thread, daemon=True)
+        self._index_task.start()
+
+    def _refresh_search_index_in_thread(self):
+        self.search_index.refresh()
+        self.search_index.flush()
+
     def show_search_dialog(self):
         """Вывод окна поиска"""
         def on_file_selected(filepath):
@@ -40,6 +69,7 @@ class MainPanel(BoxLayout):
 
         dialog = Dialogs.SearchDialog(
             vault_dir=self.vault_dir,
+            search_index=self.search_index,
             on_file_select_callback=on_file_selected
         )
         dialog.open()
@@ -68,25 +98,22 @@ class MainPanel(BoxLayout):
 
         filepath = selection[0]
         self.note_editor.current_file = filepath
-        self.note_editor.drawing_data = []
+        self.note_editor.set_lazy_drawings(None)
 
         try:
-            with open(filepath, 'r', encoding='utf-8-sig') as f:
-                if filepath.endswith('.json'):
-                    try:
-                        data = json.load(f)
-                        if isinstance(data, dict) and 'text' in data:
-                            self.note_editor.ids.editor.text = data['text']
-                            if 'drawings' in data:
-                                for drawing in data['drawings']:
-                                    if 'is_new' not in drawing:
-                                        drawing['is_new'] = True
-                                    self.note_editor.drawing_data.append(drawing)
-                    except Exception as e:
-                        print(f"Invalid JSON: {e}")
-                else:
+            if filepath.endswith('.json'):
+                try:
+                    # Текст читается сразу, рисунки - только когда будут показаны
+                    data, drawings_loader, legacy_drawings = note_storage.read_note(filepath)
+                    self.note_editor.ids.editor.text = data['text']
+                    self.note_editor.set_lazy_drawings(drawings_loader, legacy_drawings)
+                except Exception as e:
+                    print(f"Invalid JSON: {e}")
+            else:
+                with open(filepath, 'r', encoding='utf-8-sig') as f:
                     self.note_editor.ids.editor.text = f.read()
 
+            self.note_editor.mark_clean()
             self.note_editor.update_preview(force=True)
         except Exception as e:
             print(f"Load error: {e}")
@@ -114,14 +141,9 @@ class MainPanel(BoxLayout):
                 )
 
             try:
-                note_data = {
-                    "version": 1.3,
-                    "text": f"# {os.path.splitext(filename)[0]}\n\n",
-                    "drawings": []
-                }
-
-                with open(new_note_path, 'w', encoding='utf-8') as f:
-                    json.dump(note_data, f, indent=2)
+                note_data = note_storage.build_note_data(f"# {os.path.splitext(filename)[0]}\n\n")
+                note_storage.write_note(new_note_path, note_data)
+                self.search_index.update_document(new_note_path, note_data["text"])
 
                 self.update_file_list()
                 self.load_note([new_note_path])
@@ -176,6 +198,14 @@ class SmartNote(App):
         Window.clearcolor = (1, 1, 1, 1)  # RGBA значения (от 0 до 1)
         return MainPanel()
 
+    def on_stop(self):
+        # Несохраненные правки и заметки в очереди записи попадают на диск до выхода
+        self.root.note_editor.save_note()
+        self.root.note_editor.note_writer.close()
+        if self.root.search_index.ready.is_set():
+            self.root.search_index.flush()
+        self.root.summary_cache.flush()
+
 
 if __name__ == '__main__':
     SmartNote().run()
\ No newline at end of file
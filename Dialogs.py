@@ -1,13 +1,23 @@
-import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
 
+from kivy.clock import Clock
 from kivy.graphics import Rectangle, Color
+from kivy.properties import StringProperty, BooleanProperty, NumericProperty
 from kivy.uix.popup import Popup
 import os
+
+import search_index
 import utils
 
 from kivy.metrics import dp
 from kivy.uix.behaviors import ButtonBehavior
 from kivy.uix.label import Label
+from kivy.utils import escape_markup
+
+
+INDEX_WAIT_INTERVAL = 0.2  # как часто поиск, ждущий построения индекса, проверяет отмену, сек
 
 
 class BaseDialog(Popup):
@@ -78,10 +88,24 @@ class SearchDialog(Popup):
     """
     Класс для диалога поиска файлов
     """
-    def __init__(self, vault_dir, on_file_select_callback=None, **kwargs):
+    ranking = StringProperty(search_index.RANKING_BM25)  # формула ранжирования результатов
+    live_search = BooleanProperty(True)  # искать по мере ввода запроса
+    debounce_delay = NumericProperty(0.3)  # пауза после нажатия клавиши перед поиском, сек
+
+    def __init__(self, vault_dir, search_index, on_file_select_callback=None, **kwargs):
         super().__init__(**kwargs)
         self.vault_dir = vault_dir
+        self.search_index = search_index
         self.on_file_select_callback = on_file_select_callback
+
+        # Поиск выполняется в фоновом потоке, устаревшие запросы отменяются
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._search_generation = 0
+        self._pending_search = None
+        self._cancel_event = None
+        self._dismissed = False  # после закрытия диалога пул потоков остановлен, новые поиски не запускаются
+        self._live_search_trigger = Clock.create_trigger(self._run_live_search, self.debounce_delay)
+        self.bind(on_dismiss=self._shutdown_search)
         self.empty_label = Label(
             text="Ничего не найдено :(",
             font_size=dp(18),
@@ -90,50 +114,129 @@ class SearchDialog(Popup):
             valign='middle'
         )
 
+    def on_query_changed(self, query):
+        """
+        Обработчик ввода запроса: в режиме живого поиска откладывает поиск
+        до паузы в наборе текста
+        """
+        if not self.live_search:
+            return
+        self._live_search_trigger.cancel()
+        self._live_search_trigger()
+
+    def _run_live_search(self, dt):
+        self.do_search(self.ids.search_input.text)
+
     def do_search(self, query):
+        self._live_search_trigger.cancel()
+        if self._dismissed:
+            return
+        self._cancel_search()
+        self._search_generation += 1
+
         if not query.strip():
+            self.ids.suggestions_label.text = ""
             self._show_empty_state("Введите поисковый запрос")
             return
 
-        # Очищаем предыдущие результаты
-        self.ids.results_container.clear_widgets()
+        self._cancel_event = threading.Event()
+        self._pending_search = self._executor.submit(
+            self._search_in_thread, self._search_generation, query, self.ranking, self._cancel_event
+        )
+
+    def _search_in_thread(self, generation, query, ranking, cancel_event):
+        """
+        Выполняет поиск в фоновом потоке и передаёт результаты в главный поток.
+        Пока индекс строится при запуске, показывает это и ждёт готовности индекса,
+        а не возвращает неполные результаты
+        """
+        if not self.search_index.ready.is_set():
+            Clock.schedule_once(partial(self._show_index_building, generation))
+            while not self.search_index.ready.wait(INDEX_WAIT_INTERVAL):
+                if cancel_event.is_set():
+                    return
 
-        # Загружаем все заметки из хранилища
-        documents = []
-        for root, _, files in os.walk(self.vault_dir):
-            for file in files:
-                if file.endswith('.json'):
-                    filepath = os.path.join(root, file)
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            if 'text' in data:
-                                content = data['text']
-                                documents.append((filepath, content))
-                    except Exception as e:
-                        print(f"Error reading {filepath}: {e}")
-
-        # Выполняем поиск
-        results = utils.compute_tfidf_for_search(query, documents)
+        try:
+            results = self.search_index.search(query, top_k=5, ranking=ranking, cancel_event=cancel_event)
+            results = [
+                (filepath, score, self.search_index.snippet(filepath, query))
+                for filepath, score in results
+            ]
+            query_words = utils.tokenize(query)
+            suggestions = self.search_index.suggest(query_words[-1]) if query_words else []
+        except Exception as e:
+            print(f"[Search] Ошибка поиска: {e}")
+            results, suggestions = [], []
+
+        if not cancel_event.is_set():
+            Clock.schedule_once(partial(self._show_results, generation, results, suggestions))
+
+    def _cancel_search(self):
+        """
+        Отменяет предыдущий запрос: ещё не начатый снимается с очереди,
+        выполняющийся прерывается по событию отмены
+        """
+        if self._pending_search is not None:
+            self._pending_search.cancel()
+            self._pending_search = None
+        if self._cancel_event is not None:
+            self._cancel_event.set()
+            self._cancel_event = None
+
+    def _show_index_building(self, generation, dt=None):
+        if self._dismissed or generation != self._search_generation:
+            return
+        self.ids.suggestions_label.text = ""
+        self._show_empty_state("Индекс строится…")
+
+    def _show_results(self, generation, results, suggestions, dt=None):
+        if self._dismissed or generation != self._search_generation:
+            return  # Диалог закрыт или результаты устаревшего запроса
+
+        self.ids.suggestions_label.text = "Возможно: " + ", ".join(suggestions) if suggestions else ""
 
         if not results:
             self._show_empty_state("Ничего не найдено :(")
             return
 
+        # Очищаем предыдущие результаты
+        self.ids.results_container.clear_widgets()
+
         # Отображаем результаты в виде карточек
-        for filepath, score in results[:5]:  # Показываем топ-5 результатов
-            card = self._create_result_card(filepath, score)
+        for filepath, score, snippet in results:  # Показываем топ-5 результатов
+            card = self._create_result_card(filepath, score, snippet)
             self.ids.results_container.add_widget(card)
 
-    def _create_result_card(self, filepath, score):
+    def _shutdown_search(self, *args):
+        self._dismissed = True
+        self._live_search_trigger.cancel()
+        self._cancel_search()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def set_ranking(self, ranking):
+        """
+        Переключает формулу ранжирования и повторяет поиск по текущему запросу
+        """
+        if ranking == self.ranking:
+            return
+        self.ranking = ranking
+        if self.ids.search_input.text.strip():
+            self.do_search(self.ids.search_input.text)
+
+    def _create_result_card(self, filepath, score, snippet=''):
         filename = os.path.splitext(os.path.basename(filepath))[0]
         rel_path = os.path.relpath(filepath, self.vault_dir)
 
+        text = f"[size=25][b]{escape_markup(filename)}[/b][/size]\n[size=12]{escape_markup(rel_path)}[/size]"
+        if snippet:
+            # Фрагмент с подсвеченными словами запроса
+            text += f"\n[size=14]{snippet}[/size]"
+
         card = ClickableLabel(
-            text=f"[size=25][b]{filename}[/b][/size]\n[size=12]{rel_path}[/size]",
+            text=text,
             markup=True,
             size_hint_y=None,
-            height=dp(90),  # Увеличиваем высоту для крупного текста
+            height=dp(140) if snippet else dp(90),  # Увеличиваем высоту для крупного текста
             halign='left',
             valign='top',
             color=(0.2, 0.2, 0.2, 1),
@@ -7,18 +7,29 @@ import shutil
 
 from kivy.clock import Clock
 from kivy.animation import Animation
-from kivy.properties import StringProperty, BooleanProperty, ListProperty, NumericProperty
+from kivy.properties import StringProperty, BooleanProperty, ListProperty, NumericProperty, ObjectProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.popup import Popup
 from kivy.uix.label import Label
 from kivy.graphics import Color, Line, Rectangle
 
+import note_storage
 import summarizer_model
 from Dialogs import SummaryPopup
-from utils import preprocess_to_html
+from drawing_layer import StrokeLayer
+from stroke_index import StrokeGrid, point_segment_distance
+from utils import content_hash, preprocess_to_html
 
 
 class NoteEditor(BoxLayout):
+    # Строка состояния окна суммаризации, пока вместо текста модели показана извлекающая выдержка
+    EXTRACTIVE_STATUS = {
+        summarizer_model.MODEL_READY: "Быстрая выдержка (модель занята)...",
+        summarizer_model.MODEL_UNLOADED: "Быстрая выдержка (запуск модели)...",
+        summarizer_model.MODEL_LOADING: "Быстрая выдержка (загрузка модели)...",
+        summarizer_model.MODEL_ERROR: "Быстрая выдержка (модель недоступна, повторная попытка загрузки)...",
+    }
+
     note_content = StringProperty('')
     preview_content = StringProperty('')
     current_file = StringProperty('')  # Изменено: пустая строка вместо None
@@ -27,14 +38,32 @@ class NoteEditor(BoxLayout):
     brush_color = ListProperty([201 / 256, 115 / 256, 155 / 256, 1])
     brush_width = NumericProperty(5)
     drawing_data = ListProperty([])
+    search_index = ObjectProperty(None, allownone=True)
+    summarizer_state = StringProperty(summarizer_model.MODEL_UNLOADED)
+    summarizer_preload_delay = NumericProperty(0)  # через сколько секунд после запуска загрузить модель заранее (0 - не загружать)
 
     def __init__(self, **kwargs):
         self._last_canvas_pos = (0, 0)
         self._erase_mode = 'point'  # режим стирания ('point' или 'line')
         super().__init__(**kwargs)
         self.current_line = None
+        self.stroke_layer = None  # создается при первой отрисовке, когда есть ids.preview
+        self._rebuild_stroke_layer = False  # рисунки заменены целиком (другая заметка): слой перестраивается
         self.bind(drawing_data=self.update_canvas)
+        self.bind(drawing_data=self.mark_drawings_dirty)
+        # Сетка отрезков штрихов: стирание проверяет только штрихи рядом с курсором
+        self.stroke_grid = StrokeGrid()
+        self.bind(drawing_data=self._sync_stroke_grid)
         self.autosave_trigger = Clock.create_trigger(self.autosave, 30)
+        self.note_writer = note_storage.NoteWriter()
+        # Что уже лежит на диске: заметки без изменений не перезаписываются
+        self._saved_file = ''
+        self._saved_text_hash = None
+        self._drawings_dirty = False
+        self._drawings_changes = 0  # счетчик правок рисунков: успешная запись снимает пометку, только если правок после нее не было
+        self._save_failed = False  # о неудачной записи пользователь уже предупрежден
+        self._drawings_loader = None  # рисунки заметки, еще не прочитанные с диска (декодируются при показе)
+        self._legacy_drawings = False  # рисунки еще не в файле рисунков этой заметки (формат 1.3, 1.4 или переименование)
         self._last_right_click_time = 0  # Для отслеживания двойного клика
         self.brush_settings_popup = None  # Add this line
         self._red = 1.0
@@ -42,7 +71,14 @@ class NoteEditor(BoxLayout):
         self._blue = 1.0
         self._brightness = 1.0
 
-        self.summarizator = summarizer_model.TextSummarizer("ML/model")
+        # Модель загружается при первой суммаризации, а не при запуске
+        self.summarizator = summarizer_model.TextSummarizer("ML/model", on_state_change=self._on_summarizer_state)
+        self._summary_job = None
+        if self.summarizer_preload_delay > 0:
+            Clock.schedule_once(lambda dt: self.summarizator.warm_up(), self.summarizer_preload_delay)
+
+    def _on_summarizer_state(self, state):
+        self.summarizer_state = state
 
 
     def toggle_mode(self):
@@ -89,9 +125,68 @@ class NoteEditor(BoxLayout):
         """
         self.autosave_trigger()
 
+    def mark_drawings_dirty(self, *args):
+        """
+        Рисунки изменились и должны попасть в следующее сохранение
+        """
+        self._drawings_dirty = True
+        self._drawings_changes += 1
+        self.autosave_trigger()
+
+    def mark_clean(self):
+        """
+        Текущее содержимое редактора совпадает с файлом (вызывается после загрузки заметки)
+        """
+        self._saved_file = self.current_file
+        self._saved_text_hash = content_hash(self.ids.editor.text)
+        self._drawings_dirty = False
+
+    def is_dirty(self):
+        return (self.current_file != self._saved_file
+                or self._drawings_dirty
+                or content_hash(self.ids.editor.text) != self._saved_text_hash)
+
+    def set_lazy_drawings(self, loader, legacy=False):
+        """
+        Запоминает, как загрузить рисунки заметки; сами штрихи читаются
+        и декодируются только когда становится виден слой рисования
+        :param loader: функция без аргументов, возвращающая список рисунков
+        :param legacy: рисунки лежат внутри JSON старого формата или в файле рисунков
+            под другим именем и при сохранении должны быть перенесены в файл рисунков заметки
+        """
+        self._drawings_loader = loader
+        self._legacy_drawings = legacy
+        self._rebuild_stroke_layer = True
+        self.drawing_data = []
+        if not self.edit_mode:
+            self.ensure_drawings_loaded()
+
+    def ensure_drawings_loaded(self):
+        """
+        Загружает отложенные рисунки заметки (если они еще не загружены)
+        """
+        loader = self._drawings_loader
+        if loader is None:
+            return
+        self._drawings_loader = None
+        try:
+            drawings = loader()
+        except Exception as e:
+            print(f"Ошибка загрузки рисунков: {e}")
+            drawings = []
+        dirty, changes = self._drawings_dirty, self._drawings_changes
+        self._rebuild_stroke_layer = True
+        self.drawing_data = drawings
+        # Загруженные с диска рисунки не требуют сохранения
+        self._drawings_dirty, self._drawings_changes = dirty, changes
+
+    def on_edit_mode(self, instance, value):
+        if not value:
+            self.ensure_drawings_loaded()
+
     def autosave(self, dt):
         """
-        Автоматическое сохранение заметки
+        Автоматическое сохранение заметки (только если она изменилась)
         """
         if self.current_file and self.ids.editor.text:
             self.save_note()
@@ -154,29 +249,78 @@ class NoteEditor(BoxLayout):
             }
 
     def save_note(self):
+        """
+        Сохраняет заметку, если она изменилась с последнего сохранения.
+        Запись идет в фоновом потоке атомарно (временный файл, fsync, os.replace).
+        Файл рисунков перезаписывается, только если менялись рисунки.
+        Заметка считается сохраненной только после успешной записи на диск
+        """
         if not self.current_file:
             return
 
-        note_data = {
-            "version": 1.3,
-            "text": self.ids.editor.text,
-            "drawings": []
-        }
-
-        # Сохраняем каждый рисунок отдельно с метаданными
-        for drawing in self.drawing_data:
-            note_data["drawings"].append({
-                "points": [round(p, 1) for p in drawing['points']],
-                "color": [round(c, 3) for c in drawing['color']],
-                "width": round(drawing['width'], 1),
-                "is_new": True
-            })
-
         if not self.current_file.endswith('.json'):
             self.current_file = os.path.splitext(self.current_file)[0] + '.json'
 
-        with open(self.current_file, 'w', encoding='utf-8') as f:
-            json.dump(note_data, f, indent=2)
+        if not self.is_dirty():
+            return
+
+        if self.current_file != self._saved_file:
+            # Новый путь: рисунки нужно записать рядом с ним, для этого их надо прочитать
+            self.ensure_drawings_loaded()
+            self._drawings_dirty = True
+        elif self._legacy_drawings:
+            # Рисунки внутри JSON старого формата или в файле рисунков под прежним именем
+            # заметки: переносим их в файл рисунков, иначе новый JSON их потеряет
+            self.ensure_drawings_loaded()
+            self._drawings_dirty = True
+
+        # Снимок данных собирается здесь, в потоке интерфейса, пока рисунки не изменились
+        note_data = note_storage.build_note_data(self.ids.editor.text)
+        text_hash = content_hash(self.ids.editor.text)
+        drawings_changes = self._drawings_changes
+        drawings = None
+        if self._drawings_dirty:
+            drawings = [dict(drawing, points=list(drawing['points'])) for drawing in self.drawing_data]
+
+        def on_saved(path, data):
+            self._on_note_saved(path, data)
+            Clock.schedule_once(lambda dt: self._mark_saved(path, text_hash, drawings_changes))
+
+        def on_failed(path, error):
+            Clock.schedule_once(lambda dt: self._on_note_save_failed(path, error))
+
+        self.note_writer.save(self.current_file, note_data, drawings, on_saved, on_failed)
+
+    def _on_note_saved(self, path, note_data):
+        """
+        Вызывается в потоке записи после сохранения заметки
+        """
+        if self.search_index:
+            self.search_index.update_document(path, note_data["text"])
+
+    def _mark_saved(self, path, text_hash, drawings_changes):
+        """
+        Запись заметки завершилась успешно: снимок, ушедший на диск, становится сохраненным состоянием
+        :param text_hash: хеш записанного текста
+        :param drawings_changes: значение счетчика правок рисунков на момент снимка
+        """
+        self._save_failed = False
+        if path != self.current_file:
+            return  # уже открыта другая заметка, ее состояние не трогаем
+        self._saved_file = path
+        self._saved_text_hash = text_hash
+        self._legacy_drawings = False  # рисунки уже в файле рисунков
+        if self._drawings_changes == drawings_changes:
+            self._drawings_dirty = False
+
+    def _on_note_save_failed(self, path, error):
+        """
+        Запись заметки не удалась: заметка остается несохраненной, пользователь предупреждается один раз
+        """
+        if self._save_failed:
+            return
+        self._save_failed = True
+        self.show_popup("Ошибка сохранения", f"Не удалось сохранить {os.path.basename(path)}:\n{error}")
 
     def load_note(self, selection):
         if not selection:
@@ -259,6 +403,9 @@ class NoteEditor(BoxLayout):
         """Очищает редактор и сбрасывает все данные"""
         self.current_file = ''  # Пустая строка вместо None
         self.ids.editor.text = ""
+        self._drawings_loader = None
+        self._legacy_drawings = False
+        self._rebuild_stroke_layer = True
         self.drawing_data = []
         self.update_canvas()
 
@@ -307,42 +454,36 @@ class NoteEditor(BoxLayout):
                 return True
             elif 'left' in touch.button and self.current_line:
                 self.current_line['points'].extend([local_x, local_y])
-                self.update_canvas()
+                self.stroke_grid.extend_stroke(self.current_line)
+                self._drawings_dirty = True
+                self._drawings_changes += 1
+                self.autosave_trigger()  # иначе конец штриха, нарисованный после срабатывания автосохранения, не сохранится
+                # Меняются только точки активной линии, остальные штрихи не перерисовываются
+                if self.stroke_layer is not None:
+                    self.stroke_layer.update_points(self.current_line)
                 return True
 
         return super().on_touch_move(touch)
 
+    def _sync_stroke_grid(self, *args):
+        self.stroke_grid.sync(self.drawing_data)
+
     def erase_along_line(self, x1, y1, x2, y2, radius=5):
         """Стирает рисунки вдоль линии между точками (x1,y1) и (x2,y2)"""
-        steps = max(3, int(((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5 / 2))
-        changed = False
-
-        for i in range(steps):
-            t = i / (steps - 1)
-            x = x1 + t * (x2 - x1)
-            y = y1 + t * (y2 - y1)
-
-            new_drawing_data = []
-            for drawing in self.drawing_data:
-                points = drawing['points']
-                remove_drawing = False
-
-                for j in range(0, len(points) - 1, 2):
-                    px, py = points[j], points[j + 1]
-                    distance = ((px - x) ** 2 + (py - y) ** 2) ** 0.5
-                    if distance < radius:
-                        remove_drawing = True
-                        changed = True
-                        break
-
-                if not remove_drawing:
-                    new_drawing_data.append(drawing)
-
-            self.drawing_data = new_drawing_data
+        removed = set()
+        for key, (drawing, segments) in self.stroke_grid.query_segment(x1, y1, x2, y2, radius).items():
+            points = drawing['points']
+            # Отрезок с номером s соединяет точки s и s + 1
+            for j in sorted({i for segment in segments for i in (segment * 2, segment * 2 + 2)}):
+                if j + 1 < len(points) and point_segment_distance(points[j], points[j + 1], x1, y1, x2, y2) < radius:
+                    removed.add(key)
+                    break
 
-        if changed:
-            self.update_canvas()
-        return changed
+        if not removed:
+            return False
+        # Присваивание drawing_data одно на весь жест, оно же обновляет холст и сетку
+        self.drawing_data = [drawing for drawing in self.drawing_data if id(drawing) not in removed]
+        return True
 
     def erase_at_point(self, x, y, radius=10):
         """
@@ -351,48 +492,62 @@ class NoteEditor(BoxLayout):
         if not self.drawing_data:
             return False
 
-        changed = False
-        new_drawings = []
-
-        for drawing in self.drawing_data:
+        replacements = {}  # id штриха -> куски, оставшиеся после стирания
+        for key, (drawing, segments) in self.stroke_grid.query_circle(x, y, radius).items():
             points = drawing['points']
             if len(points) < 4:
                 continue
+            hit = any(
+                self.line_intersects_circle(points[i], points[i + 1], points[i + 2], points[i + 3], x, y, radius)
+                for i in (segment * 2 for segment in segments) if i + 3 < len(points)
+            )
+            if hit:
+                replacements[key] = self._split_stroke(drawing, x, y, radius)
+
+        if not replacements:
+            return False
 
-            new_segments = []
-            current_segment = [points[0], points[1]]
-
-            for i in range(2, len(points) - 1, 2):
-                x1, y1 = points[i - 2], points[i - 1]
-                x2, y2 = points[i], points[i + 1]
-
-                if x1 == x2 and y1 == y2:
-                    continue
+        new_drawings = []
+        for drawing in self.drawing_data:
+            new_drawings.extend(replacements.get(id(drawing), [drawing]))
+        self.drawing_data = new_drawings
+        return True
 
-                if self.line_intersects_circle(x1, y1, x2, y2, x, y, radius):
-                    changed = True
-                    if len(current_segment) >= 2:
-                        new_segments.append(current_segment.copy())
-                    current_segment = []
-                else:
-                    if not current_segment:
-                        current_segment.extend([x1, y1])
-                    current_segment.extend([x2, y2])
+    def _split_stroke(self, drawing, x, y, radius):
+        """
+        Разрывает штрих в местах, где его отрезки пересекают круг стирания
+        :return: список оставшихся кусков штриха
+        """
+        points = drawing['points']
+        new_segments = []
+        current_segment = [points[0], points[1]]
 
-            if current_segment:
-                new_segments.append(current_segment)
+        for i in range(2, len(points) - 1, 2):
+            x1, y1 = points[i - 2], points[i - 1]
+            x2, y2 = points[i], points[i + 1]
 
-            for segment in new_segments:
-                if len(segment) >= 4:
-                    new_drawing = drawing.copy()
-                    new_drawing['points'] = segment
-                    new_drawings.append(new_drawing)
+            if x1 == x2 and y1 == y2:
+                continue
 
-        if changed:
-            self.drawing_data = new_drawings
-            self.update_canvas()
-            return True
-        return False
+            if self.line_intersects_circle(x1, y1, x2, y2, x, y, radius):
+                if len(current_segment) >= 2:
+                    new_segments.append(current_segment.copy())
+                current_segment = []
+            else:
+                if not current_segment:
+                    current_segment.extend([x1, y1])
+                current_segment.extend([x2, y2])
+
+        if current_segment:
+            new_segments.append(current_segment)
+
+        pieces = []
+        for segment in new_segments:
+            if len(segment) >= 4:
+                new_drawing = drawing.copy()
+                new_drawing['points'] = segment
+                pieces.append(new_drawing)
+        return pieces
 
     def line_intersects_circle(self, x1, y1, x2, y2, cx, cy, r):
         """
@@ -459,28 +614,22 @@ class NoteEditor(BoxLayout):
               size_hint=(0.4, 0.2)).open()
 
     def update_canvas(self, *args):
-        if not hasattr(self, 'ids'):
-            return
-
-        self.ids.preview.canvas.after.clear()
-
-        if not self.drawing_data:
+        """
+        Синхронизирует слой рисунков превью с drawing_data: группы инструкций
+        создаются и удаляются только для изменившихся штрихов.
+        После загрузки другой заметки слой перестраивается полностью
+        """
+        if not hasattr(self, 'ids') or 'preview' not in self.ids:
             return
 
         # Рисуем ТОЛЬКО в превью
-        with self.ids.preview.canvas.after:
-            for drawing in self.drawing_data:
-                try:
-                    Color(*drawing['color'])
-                    if len(drawing['points']) >= 2:
-                        Line(
-                            points=drawing['points'],
-                            width=drawing['width'],
-                            cap='round',
-                            joint='round'
-                        )
-                except Exception as e:
-                    print(f"Error drawing: {e}")
+        if self.stroke_layer is None:
+            self.stroke_layer = StrokeLayer(self.ids.preview.canvas.after)
+        if self._rebuild_stroke_layer:
+            self._rebuild_stroke_layer = False
+            self.stroke_layer.rebuild(self.drawing_data)
+        else:
+            self.stroke_layer.sync(self.drawing_data)
 
     def normalize_coordinates(self, points, width, height):
         """
@@ -660,26 +809,84 @@ class NoteEditor(BoxLayout):
 
     def summarize(self):
         """
-        Суммаризация с индикатором загрузки
+        Суммаризация в фоновом потоке с потоковым выводом: окно с результатом
+        открывается сразу, текст дописывается по мере готовности частей
         """
         if not self.ids.editor.text:
             self._show_summary_popup("Нет текста для суммаризации")
             return
 
-        popup = Popup(
-            title="Суммаризация",
-            size_hint=(0.6, 0.4),
-            separator_color=[179 / 256, 179 / 256, 179 / 256, 1]
-        )
-        popup.content = Label(text="Обработка текста...")
-        popup.open()
+        self.cancel_summary()
+
+        popup = SummaryPopup()
+        text = self.ids.editor.text
+
+        def show_extractive():
+            popup.ids.summary_text.text = preprocess_to_html(self.summarizator.summarize_extractive(text))
+
+        if self.summarizer_state == summarizer_model.MODEL_READY and not self.summarizator.busy:
+            popup.ids.status_label.text = "Обработка текста..."
+        else:
+            # Пока модель загружается или занята, показываем извлекающую выдержку,
+            # ее заменит текст модели, как только будет готова первая часть
+            show_extractive()
+            popup.ids.status_label.text = self.EXTRACTIVE_STATUS.get(
+                self.summarizer_state, self.EXTRACTIVE_STATUS[summarizer_model.MODEL_READY])
+
+        def progress_callback(processed, total):
+            popup.ids.status_label.text = f"Обработка текста... ({processed}/{total})"
+
+        def partial_callback(text):
+            popup.ids.summary_text.text = preprocess_to_html(text)
 
         def summary_callback(summary):
-            popup.dismiss()
-            self._show_summary_popup(summary)
+            self._summary_job = None
+            popup.unbind(on_dismiss=cancel_callback)
+            if summary.startswith(summarizer_model.ERROR_PREFIX):
+                # Модель не справилась: остается извлекающая выдержка, ошибка - в строке состояния
+                if not popup.ids.summary_text.text:
+                    show_extractive()
+                popup.ids.status_label.text = f"Быстрая выдержка. {summary}"
+                return
+            popup.ids.status_label.text = ""
+            popup.ids.summary_text.text = preprocess_to_html(summary)
+
+        def cancel_callback(*args):
+            # Закрытие окна отменяет суммаризацию
+            self.cancel_summary()
+
+        popup.bind(on_dismiss=cancel_callback)
+        popup.open()
+
+        self._summary_job = self.summarizator.summarize_async(
+            text,
+            on_done=summary_callback,
+            on_progress=progress_callback,
+            on_partial=partial_callback
+        )
 
-        summary = self.summarizator.summarize(self.ids.editor.text)
-        summary_callback(summary)
+    def quick_summary(self):
+        """
+        Мгновенный предпросмотр: извлекающая суммаризация без нейросетевой модели
+        """
+        if not self.ids.editor.text:
+            self._show_summary_popup("Нет текста для суммаризации")
+            return
+        self._show_summary_popup(self.summarizator.summarize_extractive(self.ids.editor.text))
+
+    def cancel_summary(self):
+        """
+        Отменяет текущую суммаризацию (если она идет)
+        """
+        if self._summary_job is not None:
+            self._summary_job.cancel()
+            self._summary_job = None
+
+    def on_current_file(self, instance, value):
+        """
+        При переключении заметки суммаризация предыдущей больше не нужна
+        """
+        self.cancel_summary()
 
     def _show_summary_popup(self, text):
         """
@@ -0,0 +1,95 @@
+"""
+Сравнение скорости очистки Markdown: прежняя цепочка re.sub против
+однопроходного utils.preprocess_markdown на синтетическом хранилище.
+
+Запуск из корня проекта:
+    python benchmarks/preprocess_benchmark.py [число заметок] [слов в заметке]
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+
+
+WORDS = (
+    "преобразование фурье ряд тейлора интеграл производная матрица вектор "
+    "лекция конспект функция предел теорема доказательство notes lecture "
+    "summary model matrix gradient"
+).split()
+
+
+def legacy_preprocess_markdown(text):
+    """
+    Прежняя реализация utils.preprocess_markdown (восемь проходов re.sub)
+    """
+    text = re.sub(r'#{1,6}\s*', '', text)
+    text = re.sub(r'\!?\[.*?\]\(.*?\)', '', text)
+    text = re.sub(r'\*{1,2}(.*?)\*{1,2}', r'\1', text)
+    text = re.sub(r'`{1,3}(.*?)`{1,3}', r'\1', text)
+    text = re.sub(r'[\-\*\+]\s+', '', text)
+    text = re.sub(r'\d+\.\s+', '', text)
+    text = re.sub(r'[^\w\s]', ' ', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text
+
+
+def make_note(rng, words_per_note):
+    lines = [f"# {rng.choice(WORDS).capitalize()} {rng.choice(WORDS)}", ""]
+    written = 0
+    while written < words_per_note:
+        kind = rng.random()
+        words = rng.choices(WORDS, k=rng.randint(5, 15))
+        written += len(words)
+        if kind < 0.15:
+            lines.append("- " + " ".join(words))
+        elif kind < 0.25:
+            lines.append(f"{rng.randint(1, 20)}. " + " ".join(words))
+        elif kind < 0.35:
+            words[0] = f"**{words[0]}**"
+            words[-1] = f"`{words[-1]}`"
+            lines.append(" ".join(words) + ".")
+        elif kind < 0.4:
+            lines.append(" ".join(words) + f" [{words[0]}](https://example.com/{words[1]}).")
+        else:
+            lines.append(" ".join(words) + ", " + rng.choice(WORDS) + ".")
+    return "\n".join(lines)
+
+
+def measure(func, notes, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for note in notes:
+            func(note)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    note_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    words_per_note = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    rng = random.Random(42)
+    notes = [make_note(rng, words_per_note) for _ in range(note_count)]
+    size_mb = sum(len(note.encode('utf-8')) for note in notes) / 2 ** 20
+    print(f"Синтетическое хранилище: {note_count} заметок, {size_mb:.1f} MB")
+
+    legacy_time = measure(legacy_preprocess_markdown, notes)
+    new_time = measure(utils.preprocess_markdown, notes)
+    tokens_time = measure(utils.markdown_words, notes)
+
+    print(f"цепочка re.sub:            {size_mb / legacy_time:8.1f} MB/s")
+    print(f"preprocess_markdown:       {size_mb / new_time:8.1f} MB/s  (x{legacy_time / new_time:.1f})")
+    print(f"markdown_words (токены):   {size_mb / tokens_time:8.1f} MB/s  (x{legacy_time / tokens_time:.1f})")
+
+    same = sum(legacy_preprocess_markdown(note) == utils.preprocess_markdown(note) for note in notes)
+    print(f"Совпадение результата с прежней реализацией: {same}/{note_count} заметок")
+
+
+if __name__ == '__main__':
+    main()
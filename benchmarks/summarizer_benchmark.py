@@ -0,0 +1,136 @@
+"""
+Сравнение бэкендов суммаризации на CPU: время загрузки, задержка на часть текста,
+пиковая память процесса (RSS) и похожесть результата на исходный PyTorch вариант.
+
+Каждый бэкенд запускается в отдельном процессе, чтобы пиковый RSS не смешивался.
+Запуск из корня проекта:
+    python benchmarks/summarizer_benchmark.py [путь к модели] [бэкенды через запятую]
+По умолчанию: ML/model, torch,torch-int8,onnx. Тексты берутся из заметок my_vault,
+если их нет - используется синтетический текст.
+"""
+import difflib
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE_COUNT = 4
+REPEATS = 2
+
+SYNTHETIC_TEXT = (
+    "Преобразование Фурье раскладывает сигнал на сумму гармоник разной частоты. "
+    "На лекции мы рассмотрели дискретное преобразование и быстрый алгоритм его вычисления. "
+    "Быстрое преобразование Фурье снижает сложность с квадратичной до n log n. "
+    "Это позволяет обрабатывать звук и изображения в реальном времени. "
+) * 8
+
+
+def load_samples():
+    import search_index
+
+    samples = []
+    vault_dir = os.path.join(ROOT, 'my_vault')
+    for filepath in search_index.iter_note_files(vault_dir):
+        text = search_index.read_note_text(filepath)
+        if text and len(text.split()) > 50:
+            samples.append(text)
+        if len(samples) == SAMPLE_COUNT:
+            break
+    return samples or [SYNTHETIC_TEXT] * SAMPLE_COUNT
+
+
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    return usage / 2 ** 20 if sys.platform == 'darwin' else usage / 2 ** 10
+
+
+def run_worker(model_path, backend_name):
+    """
+    Замер одного бэкенда (выполняется в дочернем процессе), результат - JSON в stdout
+    """
+    import summarizer_model
+    from summarizer_backends import create_backend
+
+    backend = create_backend(backend_name, model_path)
+    start = time.perf_counter()
+    backend.load()
+    load_time = time.perf_counter() - start
+
+    prefix_ids = backend.tokenizer(summarizer_model.TASK_PREFIX, add_special_tokens=False)['input_ids']
+
+    def summarize(text):
+        # То же, что TextSummarizer._summarize_batch, но без потоков и очереди задач
+        ids = backend.tokenizer(text, add_special_tokens=False)['input_ids']
+        inputs = backend.tokenizer.pad(
+            {"input_ids": [(prefix_ids + ids)[:summarizer_model.MAX_INPUT_LENGTH - 1] + [backend.tokenizer.eos_token_id]]},
+            return_tensors="pt"
+        ).to(backend.device)
+        summary_ids = backend.generate(
+            inputs["input_ids"], inputs["attention_mask"], **summarizer_model.GENERATION_KWARGS
+        )
+        return backend.tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+
+    samples = load_samples()
+    outputs = []
+    latencies = []
+    for text in samples:
+        best = float('inf')
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            summary = summarize(text)
+            best = min(best, time.perf_counter() - start)
+        latencies.append(best)
+        outputs.append(summary)
+
+    print(json.dumps({
+        'backend': backend_name,
+        'load_time': load_time,
+        'latency': sum(latencies) / len(latencies),
+        'peak_rss_mb': peak_rss_mb(),
+        'outputs': outputs,
+    }, ensure_ascii=False))
+
+
+def similarity(a, b):
+    return difflib.SequenceMatcher(None, a.split(), b.split()).ratio()
+
+
+def main():
+    model_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, 'ML', 'model')
+    backends = sys.argv[2].split(',') if len(sys.argv) > 2 else ['torch', 'torch-int8', 'onnx']
+
+    results = {}
+    for backend_name in backends:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', model_path, backend_name],
+            capture_output=True, text=True
+        )
+        lines = [line for line in process.stdout.splitlines() if line.startswith('{')]
+        if process.returncode != 0 or not lines:
+            print(f"{backend_name}: ошибка\n{process.stderr.strip().splitlines()[-1:]}")
+            continue
+        results[backend_name] = json.loads(lines[-1])
+
+    baseline = results.get('torch')
+    print(f"{'бэкенд':<12}{'загрузка, с':>14}{'часть, с':>12}{'пик RSS, MB':>14}{'сходство':>11}")
+    for name, result in results.items():
+        if baseline:
+            scores = [similarity(a, b) for a, b in zip(baseline['outputs'], result['outputs'])]
+            match = f"{sum(scores) / len(scores):.2f}"
+        else:
+            match = '-'
+        print(f"{name:<12}{result['load_time']:>14.1f}{result['latency']:>12.2f}"
+              f"{result['peak_rss_mb']:>14.0f}{match:>11}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        run_worker(sys.argv[2], sys.argv[3])
+    else:
+        main()
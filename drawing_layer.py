@@ -0,0 +1,68 @@
+from kivy.graphics import Color, InstructionGroup, Line
+
+
+class StrokeLayer:
+    """
+    Слой рисунков с сохранением инструкций (retained mode).
+
+    У каждого штриха своя группа инструкций (Color + Line). При изменении списка
+    штрихов добавляются и удаляются только группы изменившихся штрихов, а во время
+    рисования обновляются лишь точки Line активного штриха, поэтому стоимость
+    одного движения мыши не зависит от числа штрихов заметки.
+    """
+    def __init__(self, canvas):
+        self.root = InstructionGroup()
+        canvas.add(self.root)
+        self.groups = {}  # id штриха -> (штрих, InstructionGroup, Line)
+
+    def sync(self, drawings):
+        """
+        Приводит слой к списку штрихов с сохранением порядка наложения.
+        Группы неизменившихся штрихов не пересоздаются
+        """
+        current = {id(drawing) for drawing in drawings}
+        for key in [key for key in self.groups if key not in current]:
+            self.root.remove(self.groups.pop(key)[1])
+
+        # С конца списка: новый штрих вставляется перед группой следующего за ним штриха
+        next_group = None
+        for drawing in reversed(drawings):
+            entry = self.groups.get(id(drawing))
+            if entry is None:
+                entry = self._create_group(drawing)
+                if entry is None:
+                    continue
+                self.groups[id(drawing)] = entry
+                if next_group is None:
+                    self.root.add(entry[1])
+                else:
+                    self.root.insert(self.root.indexof(next_group), entry[1])
+            next_group = entry[1]
+
+    def rebuild(self, drawings):
+        """
+        Полная перестройка слоя (после загрузки заметки или массовых правок)
+        """
+        self.root.clear()
+        self.groups = {}
+        self.sync(drawings)
+
+    def update_points(self, drawing):
+        """
+        Обновляет точки уже нарисованного штриха (активная линия во время рисования)
+        """
+        entry = self.groups.get(id(drawing))
+        if entry is None:
+            return
+        entry[2].points = drawing['points']
+
+    def _create_group(self, drawing):
+        try:
+            group = InstructionGroup()
+            group.add(Color(*drawing['color']))
+            line = Line(points=drawing['points'], width=drawing['width'], cap='round', joint='round')
+            group.add(line)
+            return drawing, group, line
+        except Exception as e:
+            print(f"Error drawing: {e}")
+            return None
@@ -0,0 +1,90 @@
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from text_chunker import sentence_spans
+from utils import preprocess_markdown, stem
+
+
+DEFAULT_RATIO = 0.2  # какую долю предложений оставлять
+DEFAULT_MAX_SENTENCES = 7
+DAMPING = 0.85
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-6
+
+
+def sentence_terms(sentence):
+    """
+    Основы слов предложения (без Markdown разметки)
+    """
+    return [stem(word) for word in preprocess_markdown(sentence.lower()).split()]
+
+
+def sentence_scores(term_lists):
+    """
+    TextRank по TF-IDF векторам предложений.
+    Граф - косинусная близость предложений, вес вершины считается степенным методом.
+    :param term_lists: список слов каждого предложения
+    :return: массив оценок предложений
+    """
+    vocabulary = {}
+    rows, cols, counts = [], [], []
+    for i, terms in enumerate(term_lists):
+        for term, count in Counter(terms).items():
+            rows.append(i)
+            cols.append(vocabulary.setdefault(term, len(vocabulary)))
+            counts.append(count)
+
+    n = len(term_lists)
+    matrix = sparse.csr_matrix((np.array(counts, dtype=np.float64), (rows, cols)), shape=(n, len(vocabulary)))
+    doc_freq = np.bincount(cols, minlength=len(vocabulary))
+    matrix = matrix @ sparse.diags(np.log((n + 1) / (doc_freq + 1)) + 1)
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix = sparse.diags(1 / norms) @ matrix
+    similarity = (matrix @ matrix.T).toarray()
+    np.fill_diagonal(similarity, 0)
+
+    # Переходы по ребрам графа; у изолированного предложения - равномерно по всем
+    out_weight = similarity.sum(axis=1, keepdims=True)
+    transition = np.where(out_weight > 0, similarity / np.where(out_weight > 0, out_weight, 1), 1 / n)
+
+    scores = np.full(n, 1 / n)
+    for _ in range(MAX_ITERATIONS):
+        updated = (1 - DAMPING) / n + DAMPING * transition.T @ scores
+        if np.abs(updated - scores).sum() < TOLERANCE:
+            return updated
+        scores = updated
+    return scores
+
+
+def summarize(text, ratio=DEFAULT_RATIO, max_sentences=DEFAULT_MAX_SENTENCES):
+    """
+    Извлекающая суммаризация: самые центральные предложения текста в исходном порядке.
+    Работает за миллисекунды, поэтому подходит, пока нейросетевая модель
+    загружается или занята, и для мгновенного предпросмотра.
+    :param text: исходный текст с Markdown разметкой
+    :param ratio: доля предложений в результате
+    :param max_sentences: максимальное число предложений
+    :return: текст из выбранных предложений
+    """
+    sentences = [text[start:end].strip() for start, end in sentence_spans(text)]
+    term_lists = [sentence_terms(sentence) for sentence in sentences]
+    # Пустые и повторяющиеся предложения не участвуют в выборе
+    seen = set()
+    candidates = []
+    for i, terms in enumerate(term_lists):
+        key = tuple(terms)
+        if terms and key not in seen:
+            seen.add(key)
+            candidates.append(i)
+
+    count = min(max_sentences, max(1, round(len(candidates) * ratio)))
+    if len(candidates) <= count:
+        return " ".join(sentences[i] for i in candidates)
+
+    scores = sentence_scores([term_lists[i] for i in candidates])
+    best = np.argsort(-scores, kind='stable')[:count]
+    return " ".join(sentences[candidates[i]] for i in sorted(best))
@@ -0,0 +1,317 @@
+import base64
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+
+
+# 1.3 - рисунки списками координат в JSON, 1.4 - упакованные массивы в JSON (base64),
+# 1.5 - в JSON только текст, упакованные рисунки лежат рядом в файле <заметка>.strokes
+NOTE_VERSION = 1.5
+STROKES_FORMAT = 'delta-q'
+DRAWINGS_SUFFIX = '.strokes'
+POINT_SCALE = 10  # координаты хранятся с точностью 0.1 пикселя
+COMPRESS_DRAWINGS = True
+
+
+def drawings_path(note_path):
+    """
+    Путь к файлу рисунков заметки
+    """
+    return os.path.splitext(note_path)[0] + DRAWINGS_SUFFIX
+
+
+def build_note_data(text):
+    """
+    Данные JSON файла заметки. Ссылку на файл рисунков (drawings_file) добавляет
+    NoteWriter, только если этот файл действительно принадлежит заметке
+    :param text: текст заметки
+    :return: словарь заметки
+    """
+    return {
+        "version": NOTE_VERSION,
+        "text": text
+    }
+
+
+def stored_drawings_path(note_path):
+    """
+    Файл рисунков, на который ссылается заметка на диске
+    :return: путь или None, если заметки нет или ссылки в ней нет
+    """
+    try:
+        with open(note_path, 'r', encoding='utf-8-sig') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or not data.get('drawings_file'):
+        return None
+    return os.path.join(os.path.dirname(note_path), data['drawings_file'])
+
+
+def pack_drawings(drawings, compress=COMPRESS_DRAWINGS):
+    """
+    Упаковывает рисунки в двоичные массивы:
+    - число точек (uint32), толщина (float32) и цвет (4 x float32) каждого штриха;
+    - первая точка штриха - абсолютные координаты (int32), умноженные на POINT_SCALE;
+    - остальные точки - разности с предыдущей точкой (int16, при больших скачках int32).
+    Массивы склеиваются и по желанию сжимаются zlib.
+    :return: (заголовок, двоичные данные)
+    """
+    strokes = [drawing for drawing in drawings if len(drawing['points']) >= 2]
+    counts = np.array([len(drawing['points']) // 2 for drawing in strokes], dtype='<u4')
+    widths = np.array([drawing['width'] for drawing in strokes], dtype='<f4')
+    colors = np.array([list(drawing['color']) for drawing in strokes], dtype='<f4').reshape(-1)
+
+    starts = []
+    deltas = []
+    for drawing, count in zip(strokes, counts):
+        points = np.rint(np.asarray(drawing['points'][:count * 2], dtype=np.float64) * POINT_SCALE)
+        points = points.astype(np.int64).reshape(-1, 2)
+        starts.append(points[0])
+        deltas.append(np.diff(points, axis=0))
+
+    starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+    deltas = np.concatenate(deltas).reshape(-1) if deltas else np.zeros(0, dtype=np.int64)
+    delta_dtype = '<i2' if not len(deltas) or np.abs(deltas).max() <= np.iinfo(np.int16).max else '<i4'
+
+    blob = b''.join([
+        counts.tobytes(), widths.tobytes(), colors.tobytes(),
+        starts.astype('<i4').tobytes(), deltas.astype(delta_dtype).tobytes()
+    ])
+    if compress:
+        blob = zlib.compress(blob)
+
+    header = {
+        "format": STROKES_FORMAT,
+        "count": len(strokes),
+        "scale": POINT_SCALE,
+        "delta_dtype": delta_dtype,
+        "compressed": compress
+    }
+    return header, blob
+
+
+def write_drawings(path, drawings):
+    """
+    Атомарно записывает файл рисунков: строка JSON заголовка, затем двоичные данные
+    """
+    header, blob = pack_drawings(drawings)
+    write_atomic(path, json.dumps(header).encode('utf-8') + b'\n' + blob)
+
+
+def read_drawings(path):
+    """
+    Читает и декодирует файл рисунков
+    :return: список рисунков (пустой, если файла нет)
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        header = json.loads(f.readline())
+        blob = f.read()
+    return decode_drawings(header, blob)
+
+
+def decode_drawings(section, blob=None):
+    """
+    Рисунки заметки из раздела drawings любой версии формата
+    :param section: список рисунков (1.3) или заголовок упакованных рисунков (1.4, 1.5)
+    :param blob: двоичные данные из файла рисунков (в 1.4 они лежат в section['data'])
+    :return: список рисунков {'points', 'color', 'width', 'is_new'}
+    """
+    if not section:
+        return []
+
+    if isinstance(section, list):  # Старый формат: координаты списками в JSON
+        for drawing in section:
+            drawing.setdefault('is_new', True)
+        return section
+
+    if section.get('format') != STROKES_FORMAT:
+        raise ValueError(f"Неизвестный формат рисунков: {section.get('format')}")
+
+    if blob is None:
+        blob = base64.b64decode(section['data'])
+    if section.get('compressed'):
+        blob = zlib.decompress(blob)
+
+    n = section['count']
+    scale = section['scale']
+    offset = 0
+
+    def take(dtype, length):
+        nonlocal offset
+        array = np.frombuffer(blob, dtype=dtype, count=length, offset=offset)
+        offset += array.nbytes
+        return array
+
+    counts = take('<u4', n)
+    widths = take('<f4', n)
+    colors = take('<f4', n * 4).reshape(-1, 4)
+    starts = take('<i4', n * 2).reshape(-1, 2)
+    deltas = take(section['delta_dtype'], int(counts.sum() - n) * 2).reshape(-1, 2)
+
+    # Одна общая cumsum вместо цикла по штрихам: в первой точке штриха стоит его начало,
+    # а накопленная сумма предыдущих штрихов вычитается
+    total = int(counts.sum())
+    firsts = np.concatenate(([0], np.cumsum(counts[:-1], dtype=np.int64))) if n else np.zeros(0, dtype=np.int64)
+    values = np.empty((total, 2), dtype=np.int64)
+    is_first = np.zeros(total, dtype=bool)
+    is_first[firsts] = True
+    values[is_first] = starts
+    values[~is_first] = deltas
+    summed = np.cumsum(values, axis=0)
+    bases = np.zeros((n, 2), dtype=np.int64)
+    bases[1:] = summed[firsts[1:] - 1]
+    coordinates = ((summed - np.repeat(bases, counts, axis=0)) / scale).reshape(-1).tolist()
+
+    colors = np.round(colors.astype(np.float64), 3).tolist()
+    widths = np.round(widths.astype(np.float64), 1).tolist()
+    drawings = []
+    for i in range(n):
+        start = int(firsts[i]) * 2
+        drawings.append({
+            'points': coordinates[start:start + int(counts[i]) * 2],
+            'color': colors[i],
+            'width': widths[i],
+            'is_new': True
+        })
+    return drawings
+
+
+def write_atomic(path, data):
+    """
+    Записывает файл атомарно: во временный файл рядом, fsync и os.replace.
+    При сбое во время записи на диске остается прежняя версия файла.
+    :param path: путь к файлу
+    :param data: содержимое (bytes)
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_note(path, note_data):
+    """
+    Синхронное атомарное сохранение JSON файла заметки
+    """
+    write_atomic(path, json.dumps(note_data, ensure_ascii=False).encode('utf-8'))
+
+
+def read_note(path):
+    """
+    Читает заметку без декодирования рисунков
+    :param path: путь к JSON файлу заметки
+    :return: (словарь заметки, функция без аргументов, возвращающая список рисунков,
+        True, если рисунки нужно переписать в файл рисунков этой заметки: они лежат внутри
+        JSON старого формата или в файле рисунков под другим именем - заметку переименовали
+        или скопировали вне приложения)
+    """
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or 'text' not in data:
+        raise ValueError("Неверный формат заметки")
+
+    if data.get('drawings_file'):
+        sidecar = os.path.join(os.path.dirname(path), data['drawings_file'])
+        foreign = os.path.normcase(os.path.abspath(sidecar)) != os.path.normcase(os.path.abspath(drawings_path(path)))
+        return data, lambda: read_drawings(sidecar), foreign
+
+    # 1.3 и 1.4: рисунки внутри JSON, декодируются тоже только по запросу
+    section = data.pop('drawings', None)
+    return data, lambda: decode_drawings(section), bool(section)
+
+
+class NoteWriter:
+    """
+    Фоновый поток записи заметок, чтобы основной цикл не ждал диск.
+    Несколько сохранений одного файла, пришедших до записи, объединяются:
+    на диск попадает только последняя версия.
+    """
+    def __init__(self):
+        self.pending = {}  # путь -> (данные заметки, рисунки или None, on_saved, on_failed)
+        self.lock = threading.Lock()
+        self.has_work = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.stop_flag = False
+
+        self.thread = threading.Thread(target=self._write_in_thread, daemon=True)
+        self.thread.start()
+
+    def save(self, path, note_data, drawings=None, on_saved=None, on_failed=None):
+        """
+        Ставит заметку в очередь на запись
+        :param note_data: данные JSON файла заметки (build_note_data), без drawings_file
+        :param drawings: снимок рисунков для файла рисунков или None, если рисунки не менялись
+        :param on_saved: вызывается в потоке записи после успешной записи: on_saved(путь, данные)
+        :param on_failed: вызывается в потоке записи при ошибке записи: on_failed(путь, исключение)
+        """
+        with self.lock:
+            if drawings is None and path in self.pending:
+                drawings = self.pending[path][1]  # рисунки из еще не записанного сохранения
+            self.pending[path] = (note_data, drawings, on_saved, on_failed)
+            self.idle.clear()
+        self.has_work.set()
+
+    def flush(self, timeout=None):
+        """
+        Ждет, пока все поставленные в очередь заметки будут записаны
+        """
+        self.idle.wait(timeout)
+
+    def close(self):
+        self.flush()
+        self.stop_flag = True
+        self.has_work.set()
+
+    def _write_in_thread(self):
+        while not self.stop_flag:
+            self.has_work.wait()
+            with self.lock:
+                batch = self.pending
+                self.pending = {}
+                self.has_work.clear()
+
+            for path, (note_data, drawings, on_saved, on_failed) in batch.items():
+                try:
+                    # Сначала рисунки, потом текст со ссылкой на них
+                    sidecar = drawings_path(path)
+                    linked = False
+                    if drawings is None:
+                        stored = stored_drawings_path(path)
+                        if stored is not None and os.path.exists(stored):
+                            if os.path.abspath(stored) == os.path.abspath(sidecar):
+                                linked = True
+                            else:
+                                # Заметку переименовали вне приложения: рисунки переезжают под новое имя
+                                drawings = read_drawings(stored)
+                    if drawings is not None and (drawings or os.path.exists(sidecar)):
+                        write_drawings(sidecar, drawings)
+                        linked = True
+                    # Ссылка только на файл рисунков самой заметки: чужой или оставшийся
+                    # от удаленной заметки файл с тем же именем не подхватывается
+                    note_data = dict(note_data)
+                    if linked:
+                        note_data['drawings_file'] = os.path.basename(sidecar)
+                    write_note(path, note_data)
+                except Exception as e:
+                    print(f"[NoteWriter] Ошибка сохранения {path}: {e}")
+                    callback, args = on_failed, (path, e)
+                else:
+                    callback, args = on_saved, (path, note_data)
+                if callback:
+                    try:
+                        callback(*args)
+                    except Exception as e:
+                        print(f"[NoteWriter] Ошибка обработчика сохранения {path}: {e}")
+
+            with self.lock:
+                if not self.pending:
+                    self.idle.set()
@@ -0,0 +1,856 @@
+import heapq
+import json
+import math
+import os
+import pickle
+import re
+import threading
+from array import array
+from collections import Counter
+
+import utils
+from term_dictionary import TermDictionary
+
+
+INDEX_FILENAME = '.search_index.pkl'
+INDEX_FILENAME_TEMPLATE = 'search_index_{}.pkl'  # в папке данных приложения, по одному файлу на хранилище
+INDEX_VERSION = 6
+
+STEMMING = True  # индексировать основы слов (Snowball), а не словоформы
+
+RANKING_TFIDF = 'tfidf'
+RANKING_BM25 = 'bm25'
+
+# Параметры Okapi BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Расширение запроса: словоформы по префиксу и слова с опечатками
+MIN_PREFIX_LENGTH = 3
+MAX_EXPANSIONS = 5
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.5
+SURFACE_SAMPLE_DOCS = 5  # в скольких заметках с наибольшей частотой термина искать его словоформы
+
+# Фразовые ("...") и NEAR/k запросы, бонус за близость слов запроса
+PHRASE_RE = re.compile(r'"([^"]+)"')
+NEAR_RE = re.compile(r'(\S+)\s+NEAR/(\d+)\s+(\S+)')
+PROXIMITY_BOOST = 0.5
+RERANK_DEPTH = 50  # сколько лучших по BM25/TF-IDF заметок переранжируется по близости
+
+# Изменённые заметки оцениваются в обход TF-IDF матрицы, пока их не наберётся столько,
+# после чего матрица перестраивается в фоне (старая используется до готовности новой)
+TFIDF_REBUILD_MIN_CHANGES = 32
+TFIDF_REBUILD_FRACTION = 0.1
+
+SNIPPET_WORDS = 24  # длина фрагмента текста в карточке результата, в словах
+SNIPPET_HIGHLIGHT = '[b][color=8a4f9e]{}[/color][/b]'
+
+
+class VaultIndex:
+    """
+    Инвертированный индекс заметок хранилища, сохраняемый на диск.
+
+    Хранит:
+    - postings: термин -> {относительный путь заметки: частота термина}
+    - doc_lengths: относительный путь заметки -> число слов в ней
+    - doc_positions: относительный путь заметки -> {термин: позиции термина в заметке}
+      (позиционный индекс для фраз и NEAR, он же нужен для удаления postings)
+    - fingerprints: относительный путь заметки -> (mtime, размер файла)
+    - doc_hashes: относительный путь заметки -> хэш текста (неизменённый текст не токенизируется заново)
+    - doc_texts: относительный путь заметки -> (текст без разметки, смещения начала слов)
+      для фрагментов в результатах поиска без повторного чтения JSON
+    Частота документов (df) термина - это размер его списка postings,
+    суммарная длина заметок поддерживается при каждом изменении (для BM25).
+
+    Поиск обращается только к спискам postings терминов запроса,
+    поэтому его стоимость не зависит от размера всего хранилища.
+    Индекс обновляется по одной заметке: при сохранении/создании заметки
+    и при изменении файлов вне приложения (см. refresh).
+    Изменения и поиск защищены блокировкой, поэтому искать можно из фонового потока.
+
+    Файл индекса - pickle, поэтому его лучше держать в папке данных приложения (index_dir),
+    а не в хранилище, которое могут синхронизировать с другими устройствами: чужой
+    pickle при загрузке может выполнить произвольный код.
+    """
+    def __init__(self, vault_dir, stemming=STEMMING, index_dir=None, build=True):
+        """
+        :param index_dir: папка для файла индекса (по умолчанию - в самом хранилище)
+        :param build: загрузить или построить индекс сразу; иначе это делает open,
+            например из фонового потока
+        """
+        self.vault_dir = vault_dir
+        self.stemming = stemming
+        if index_dir is None:
+            self.index_path = os.path.join(vault_dir, INDEX_FILENAME)
+        else:
+            os.makedirs(index_dir, exist_ok=True)
+            vault_key = utils.content_hash(os.path.abspath(vault_dir))[:16]
+            self.index_path = os.path.join(index_dir, INDEX_FILENAME_TEMPLATE.format(vault_key))
+        self.postings = {}
+        self.doc_lengths = {}
+        self.doc_positions = {}
+        self.fingerprints = {}
+        self.doc_hashes = {}
+        self.doc_texts = {}
+        self.total_length = 0
+        self.dirty = False
+        self.lock = threading.RLock()
+        self._tfidf_matrix = None  # строится лениво, после изменений перестраивается в фоне
+        self._tfidf_stale = set()  # заметки, изменённые после построения матрицы
+        self._tfidf_building = None  # заметки, изменённые после снимка для фонового построения
+        self._term_dictionary = None  # строится лениво и дальше обновляется по одному термину
+        self._surface_forms = {}  # термин -> его словоформы по убыванию частоты (для подсказок)
+        self.ready = threading.Event()  # индекс загружен или построен
+
+        if build:
+            self.open()
+
+    def open(self):
+        """
+        Загружает индекс с диска и сверяет с файлами или строит его заново
+        (долго на большом хранилище, не для потока интерфейса)
+        """
+        if not self.load():
+            self.rebuild()
+        else:
+            self.refresh()
+        self.ready.set()
+
+    @property
+    def total_docs(self):
+        return len(self.doc_lengths)
+
+    @property
+    def avg_doc_length(self):
+        return self.total_length / self.total_docs if self.total_docs else 0.0
+
+    def doc_freq(self, term):
+        return len(self.postings.get(term, ()))
+
+    def load(self):
+        """
+        Загружает индекс с диска.
+        :return: True, если индекс загружен, иначе False
+        """
+        if not os.path.exists(self.index_path):
+            return False
+
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') != INDEX_VERSION or data.get('stemming') != self.stemming:
+                print("[Index] Устаревшая версия индекса, требуется перестроение")
+                return False
+            with self.lock:
+                self.postings = data['postings']
+                self.doc_lengths = data['doc_lengths']
+                self.doc_positions = data['doc_positions']
+                self.fingerprints = data['fingerprints']
+                self.doc_hashes = data['doc_hashes']
+                self.doc_texts = data['doc_texts']
+                self.total_length = sum(self.doc_lengths.values())
+                self._reset_tfidf()
+                self._term_dictionary = None
+                self._surface_forms = {}
+        except Exception as e:
+            print(f"[Index] Ошибка чтения индекса: {e}")
+            return False
+
+        print(f"[Index] Индекс загружен: {self.total_docs} заметок, {len(self.postings)} терминов")
+        return True
+
+    def save(self):
+        """
+        Сохраняет индекс на диск (через временный файл, чтобы не повредить индекс при сбое).
+        Под блокировкой индекс только сериализуется в память, запись на диск идет без нее
+        """
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with self.lock:
+                data = {
+                    'version': INDEX_VERSION,
+                    'stemming': self.stemming,
+                    'postings': self.postings,
+                    'doc_lengths': self.doc_lengths,
+                    'doc_positions': self.doc_positions,
+                    'fingerprints': self.fingerprints,
+                    'doc_hashes': self.doc_hashes,
+                    'doc_texts': self.doc_texts,
+                }
+                payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+                self.dirty = False
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            self.dirty = True
+            print(f"[Index] Ошибка сохранения индекса: {e}")
+
+    def flush(self):
+        """
+        Сохраняет индекс на диск, только если он изменился с момента последнего сохранения
+        """
+        if self.dirty:
+            self.save()
+
+    def rebuild(self):
+        """
+        Полностью перестраивает индекс по всем заметкам хранилища
+        """
+        with self.lock:
+            self.postings = {}
+            self.doc_lengths = {}
+            self.doc_positions = {}
+            self.fingerprints = {}
+            self.doc_hashes = {}
+            self.doc_texts = {}
+            self.total_length = 0
+            self._reset_tfidf()
+            self._term_dictionary = None
+            self._surface_forms = {}
+        self.refresh()
+
+        print(f"[Index] Индекс построен: {self.total_docs} заметок, {len(self.postings)} терминов")
+        self.save()
+
+    def refresh(self):
+        """
+        Сверяет индекс с файлами хранилища по отпечаткам (mtime, размер).
+        Перечитываются только новые и изменённые заметки, удалённые убираются из индекса.
+        Заметки могут одновременно обновляться из потока записи (update_document),
+        поэтому отпечатки читаются только под блокировкой, а файлы - без нее.
+        :return: число обновлённых заметок
+        """
+        seen = set()
+        changed = 0
+        with self.lock:
+            known = dict(self.fingerprints)
+
+        for filepath in iter_note_files(self.vault_dir):
+            doc_id = self._doc_id(filepath)
+            seen.add(doc_id)
+            fingerprint = file_fingerprint(filepath)
+            if fingerprint is None or known.get(doc_id) == fingerprint:
+                continue
+
+            text = read_note_text(filepath)
+            if text is None:
+                # Запоминаем отпечаток, чтобы не перечитывать битый файл при каждой проверке
+                with self.lock:
+                    self._remove_document(doc_id)
+                    self.fingerprints[doc_id] = fingerprint
+            else:
+                self._replace_document(doc_id, text, fingerprint)
+            changed += 1
+
+        with self.lock:
+            # Заметка, созданная после обхода папки, не считается удалённой
+            removed = [doc_id for doc_id in self.fingerprints
+                       if doc_id not in seen and not os.path.exists(os.path.join(self.vault_dir, doc_id))]
+            for doc_id in removed:
+                self._remove_document(doc_id)
+            changed += len(removed)
+
+        if changed:
+            print(f"[Index] Обновлено заметок: {changed}")
+        return changed
+
+    def update_document(self, filepath, text=None):
+        """
+        Обновляет одну заметку в индексе (например, после сохранения)
+        :param filepath: путь к файлу заметки
+        :param text: текст заметки; если не передан, читается из файла
+        """
+        if text is None:
+            text = read_note_text(filepath)
+        doc_id = self._doc_id(filepath)
+        if text is None:
+            self._remove_document(doc_id)
+        else:
+            self._replace_document(doc_id, text, file_fingerprint(filepath))
+
+    def remove_document(self, filepath):
+        """
+        Удаляет заметку из индекса
+        """
+        self._remove_document(self._doc_id(filepath))
+
+    def _doc_id(self, filepath):
+        return os.path.relpath(filepath, self.vault_dir)
+
+    def _replace_document(self, doc_id, text, fingerprint):
+        text_hash = utils.content_hash(text)
+        if self.doc_hashes.get(doc_id) == text_hash:
+            # Текст не изменился (например, сохранили только рисунок) - токенизация не нужна
+            with self.lock:
+                self.fingerprints[doc_id] = fingerprint
+                self.dirty = True
+            return
+
+        words = utils.tokenize_cached(text, self.stemming, text_hash)
+        plain_text, offsets = plain_text_with_offsets(text)
+        positions = {}
+        for position, term in enumerate(words):
+            term_positions = positions.get(term)
+            if term_positions is None:
+                positions[term] = term_positions = array('I')
+            term_positions.append(position)
+
+        with self.lock:
+            self._remove_document(doc_id)
+            self.doc_hashes[doc_id] = text_hash
+            self.doc_texts[doc_id] = (plain_text, offsets)
+            self.doc_lengths[doc_id] = len(words)
+            self.total_length += len(words)
+            self.doc_positions[doc_id] = positions
+            self.fingerprints[doc_id] = fingerprint
+            for term, term_positions in positions.items():
+                self._surface_forms.pop(term, None)
+                if term not in self.postings:
+                    self.postings[term] = {}
+                    if self._term_dictionary is not None:
+                        self._term_dictionary.add(term)
+                self.postings[term][doc_id] = len(term_positions)
+            self.dirty = True
+            self._mark_tfidf_stale(doc_id)
+
+    def _remove_document(self, doc_id):
+        with self.lock:
+            terms = self.doc_positions.pop(doc_id, None)
+            self.total_length -= self.doc_lengths.pop(doc_id, 0)
+            self.fingerprints.pop(doc_id, None)
+            self.doc_hashes.pop(doc_id, None)
+            self.doc_texts.pop(doc_id, None)
+            if terms is None:
+                return
+
+            for term in terms:
+                self._surface_forms.pop(term, None)
+                postings = self.postings.get(term)
+                if postings is None:
+                    continue
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+                    if self._term_dictionary is not None:
+                        self._term_dictionary.remove(term)
+            self.dirty = True
+            self._mark_tfidf_stale(doc_id)
+
+    def tfidf_matrix(self):
+        """
+        Разреженная TF-IDF матрица индекса. Может не учитывать заметки из _tfidf_stale:
+        они оцениваются отдельно (см. _search_tfidf)
+        """
+        with self.lock:
+            if self._tfidf_matrix is None:
+                self._tfidf_matrix = utils.TfidfMatrix.from_postings(self.postings, self.doc_lengths)
+                self._tfidf_stale = set()
+            return self._tfidf_matrix
+
+    def _reset_tfidf(self):
+        with self.lock:
+            self._tfidf_matrix = None
+            self._tfidf_stale = set()
+            self._tfidf_building = None
+
+    def _mark_tfidf_stale(self, doc_id):
+        """
+        Заметка изменилась: матрица для нее больше не верна. Когда таких заметок
+        становится много, матрица перестраивается в фоновом потоке
+        """
+        if self._tfidf_matrix is None:
+            return
+        self._tfidf_stale.add(doc_id)
+        if self._tfidf_building is not None:
+            self._tfidf_building.add(doc_id)
+        elif len(self._tfidf_stale) >= max(TFIDF_REBUILD_MIN_CHANGES, TFIDF_REBUILD_FRACTION * self.total_docs):
+            self._tfidf_building = set()
+            # Снимок под блокировкой, построение матрицы - без нее
+            postings = {term: dict(term_postings) for term, term_postings in self.postings.items()}
+            doc_lengths = dict(self.doc_lengths)
+            threading.Thread(target=self._rebuild_tfidf, args=(postings, doc_lengths, self._tfidf_building),
+                             daemon=True).start()
+
+    def _rebuild_tfidf(self, postings, doc_lengths, building):
+        try:
+            matrix = utils.TfidfMatrix.from_postings(postings, doc_lengths)
+        except Exception as e:
+            print(f"[Index] Ошибка построения TF-IDF матрицы: {e}")
+            matrix = None
+        with self.lock:
+            if self._tfidf_building is not building:
+                return  # индекс был перезагружен, снимок устарел
+            if matrix is not None:
+                self._tfidf_matrix = matrix
+                self._tfidf_stale = self._tfidf_building
+            self._tfidf_building = None
+
+    def _search_tfidf(self, term_weights, depth):
+        """
+        TF-IDF поиск: заметки, не изменившиеся после построения матрицы, оцениваются матрицей
+        (IDF по текущему индексу), изменённые - напрямую по спискам postings
+        """
+        with self.lock:
+            matrix = self.tfidf_matrix()
+            stale = self._tfidf_stale
+            idf = {term: math.log((self.total_docs + 1) / (self.doc_freq(term) + 1)) for term in term_weights}
+            if not stale:
+                return matrix.search_weighted(term_weights, depth, idf)
+
+            # Изменённые заметки убираются из результата матрицы, поэтому берём запас
+            matrix_depth = depth + len(stale) if depth is not None else None
+            scores = {doc_id: score for doc_id, score in matrix.search_weighted(term_weights, matrix_depth, idf)
+                      if doc_id not in stale}
+            for term, weight in term_weights.items():
+                postings = self.postings.get(term, {})
+                for doc_id in stale:
+                    count = postings.get(doc_id)
+                    if count:
+                        scores[doc_id] = scores.get(doc_id, 0.0) + weight * idf[term] * count / self.doc_lengths[doc_id]
+
+        results = sorted(scores.items(), key=lambda item: -item[1])
+        return results[:depth] if depth is not None else results
+
+    def term_dictionary(self):
+        """
+        Словарь терминов индекса для дополнения по префиксу и нечёткого поиска
+        """
+        with self.lock:
+            if self._term_dictionary is None:
+                self._term_dictionary = TermDictionary(self.postings)
+            return self._term_dictionary
+
+    def complete_term(self, prefix, limit=MAX_EXPANSIONS):
+        """
+        Термины индекса (основы слов), начинающиеся с префикса, самые частые первыми
+        :param prefix: начало термина
+        :param limit: максимальное число вариантов
+        """
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            return []
+        with self.lock:
+            # Берём ограниченное окно словаря, чтобы короткий префикс не разворачивался во весь словарь
+            candidates = self.term_dictionary().complete(prefix, limit=10 * limit)
+            candidates.sort(key=lambda term: -self.doc_freq(term))
+        return candidates[:limit]
+
+    def suggest(self, prefix, limit=MAX_EXPANSIONS):
+        """
+        Варианты дополнения введённого слова для показа, самые частые первыми.
+        Префикс приводится к основе так же, как термины индекса, а вместо основ
+        показываются их самые частые словоформы в заметках
+        :param prefix: начало слова, как его ввёл пользователь
+        :param limit: максимальное число вариантов
+        """
+        prefix = prefix.lower()
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            return []
+        term_prefix = utils.stem(prefix) if self.stemming else prefix
+        with self.lock:
+            terms = self.complete_term(term_prefix, limit)
+            if term_prefix != prefix:
+                # Недописанное слово основа может "обрезать" иначе, чем полное
+                terms += [term for term in self.complete_term(prefix, limit) if term not in terms]
+                terms.sort(key=lambda term: -self.doc_freq(term))
+
+            suggestions = []
+            for term in terms:
+                forms = self.surface_forms(term)
+                # Предпочтительна словоформа, продолжающая введённое слово
+                form = next((form for form in forms if form.startswith(prefix)), forms[0])
+                if form not in suggestions:
+                    suggestions.append(form)
+        return suggestions[:limit]
+
+    def surface_forms(self, term):
+        """
+        Словоформы термина в текстах заметок по убыванию частоты (основа сама по себе
+        часто не слово, показывать её пользователю нельзя). Считаются по позиционному
+        индексу в нескольких заметках, где термин встречается чаще всего
+        :return: непустой список словоформ в нижнем регистре
+        """
+        with self.lock:
+            forms = self._surface_forms.get(term)
+            if forms is not None:
+                return forms
+
+            counts = Counter()
+            postings = self.postings.get(term, {})
+            if self.stemming:
+                for doc_id in heapq.nlargest(SURFACE_SAMPLE_DOCS, postings, key=postings.get):
+                    plain_text, offsets = self.doc_texts[doc_id]
+                    for position in self.doc_positions[doc_id].get(term, ()):
+                        start = offsets[position]
+                        end = plain_text.find(' ', start)
+                        counts[plain_text[start:end if end >= 0 else len(plain_text)].lower()] += 1
+            forms = [form for form, _ in counts.most_common()] or [term]
+            self._surface_forms[term] = forms
+            return forms
+
+    def expand_query(self, query_words):
+        """
+        Превращает слова запроса во взвешенные термины индекса:
+        - слово из словаря берётся как есть;
+        - незнакомое слово и последнее (возможно, недописанное) слово
+          дополняются по префиксу - так находятся другие словоформы;
+        - если для незнакомого слова нет дополнений, ищутся слова
+          с опечаткой (расстояние Левенштейна 1-2).
+        :return: термин -> вес (с учётом частоты слова в запросе)
+        """
+        term_weights = {}
+
+        def add(term, weight):
+            term_weights[term] = max(term_weights.get(term, 0.0), weight)
+
+        last_word = query_words[-1]
+        with self.lock:
+            for word, count in Counter(query_words).items():
+                known = word in self.postings
+                if known:
+                    add(word, count)
+                if known and word != last_word:
+                    continue
+
+                completions = [term for term in self.complete_term(word) if term != word]
+                for term in completions:
+                    add(term, count * PREFIX_WEIGHT)
+
+                if not known and not completions:
+                    max_distance = 1 if len(word) <= 5 else 2
+                    dictionary = self.term_dictionary()
+                    for term, _ in dictionary.fuzzy(word, max_distance, limit=MAX_EXPANSIONS):
+                        add(term, count * FUZZY_WEIGHT)
+
+        return term_weights
+
+    def search(self, query, top_k=None, ranking=RANKING_TFIDF, cancel_event=None):
+        """
+        Ищет заметки по запросу.
+
+        Кроме обычных слов запрос может содержать:
+        - фразы в кавычках: "преобразование Фурье" - слова подряд;
+        - близость: ряд NEAR/5 Тейлора - слова не дальше 5 слов друг от друга.
+        Фразы и NEAR обязательны для найденных заметок. Лучшие заметки
+        переранжируются с бонусом за близость слов запроса; всё считается
+        по позиционному индексу, без чтения текстов заметок.
+
+        :param query: поисковый запрос
+        :param top_k: сколько лучших заметок вернуть (None - все найденные)
+        :param ranking: формула ранжирования - RANKING_TFIDF (та же формула,
+                        что и utils.compute_tfidf_for_search) или RANKING_BM25
+        :param cancel_event: threading.Event; если он установлен, поиск прерывается
+        :return: список (путь к файлу, оценка релевантности) по убыванию релевантности
+        """
+        query_words, phrases, near_clauses = self._parse_query(query)
+        if not query_words:
+            return []
+
+        with self.lock:
+            term_weights = self.expand_query(query_words)
+
+            # Фразы и NEAR фильтруют всех кандидатов, а бонусу за близость
+            # нужен запас кандидатов сверх top_k
+            positional = bool(phrases or near_clauses) or len(set(query_words)) > 1
+            if phrases or near_clauses or top_k is None:
+                depth = None
+            elif positional:
+                depth = max(top_k, RERANK_DEPTH)
+            else:
+                depth = top_k
+
+            if ranking == RANKING_BM25:
+                results = self._search_bm25(term_weights, depth, cancel_event)
+            else:
+                # Вес термина в TF-IDF - его частота в запросе
+                term_weights = {term: weight / len(query_words) for term, weight in term_weights.items()}
+                results = self._search_tfidf(term_weights, depth)
+
+            if positional:
+                results = self._rerank_by_proximity(results, query_words, phrases, near_clauses, cancel_event)
+                results = results[:top_k] if top_k is not None else results
+        return [(os.path.join(self.vault_dir, doc_id), score) for doc_id, score in results]
+
+    def _parse_query(self, query):
+        """
+        Разбирает запрос на термины индекса
+        :return: (все термины запроса, фразы - списки терминов, условия NEAR - (термин, термин, k))
+        """
+        phrases, near_clauses, free_text = parse_query(query)
+        phrases = [utils.tokenize(phrase, self.stemming) for phrase in phrases]
+        phrases = [phrase for phrase in phrases if phrase]
+        near_clauses = [
+            (utils.tokenize(left, self.stemming), utils.tokenize(right, self.stemming), distance)
+            for left, right, distance in near_clauses
+        ]
+        near_clauses = [(left[-1], right[0], distance) for left, right, distance in near_clauses if left and right]
+
+        query_words = utils.tokenize(free_text, self.stemming)
+        for phrase in phrases:
+            query_words.extend(phrase)
+        for left, right, _ in near_clauses:
+            query_words.extend((left, right))
+        return query_words, phrases, near_clauses
+
+    def snippet(self, filepath, query, window=SNIPPET_WORDS):
+        """
+        Фрагмент заметки вокруг лучшего совпадения с подсвеченными словами запроса (Kivy markup).
+        Окно выбирается по позициям терминов запроса в позиционном индексе,
+        текст берётся из сохранённой копии без разметки - файл заметки не читается.
+
+        :param filepath: путь к файлу заметки
+        :param query: поисковый запрос
+        :param window: длина фрагмента в словах
+        :return: строка с разметкой или '', если заметки нет в индексе
+        """
+        doc_id = self._doc_id(filepath)
+        query_words, _, _ = self._parse_query(query)
+
+        with self.lock:
+            doc_text = self.doc_texts.get(doc_id)
+            positions = self.doc_positions.get(doc_id)
+            if doc_text is None or positions is None:
+                return ''
+            terms = self.expand_query(query_words) if query_words else {}
+
+            hits = sorted(
+                (position, term) for term in terms if term in positions for position in positions[term]
+            )
+
+        plain_text, offsets = doc_text
+        if not offsets:
+            return ''
+
+        start = best_window_start(hits, window)
+        end = min(len(offsets), start + window)
+        hit_positions = {position for position, _ in hits if start <= position < end}
+
+        words = []
+        for position in range(start, end):
+            word_start = offsets[position]
+            word_end = offsets[position + 1] - 1 if position + 1 < len(offsets) else len(plain_text)
+            word = plain_text[word_start:word_end]
+            words.append(SNIPPET_HIGHLIGHT.format(word) if position in hit_positions else word)
+
+        prefix = '... ' if start > 0 else ''
+        suffix = ' ...' if end < len(offsets) else ''
+        return prefix + ' '.join(words) + suffix
+
+    def _rerank_by_proximity(self, results, query_words, phrases, near_clauses, cancel_event=None):
+        """
+        Отбрасывает заметки без обязательных фраз/NEAR и добавляет бонус за близость:
+        совпадения фраз и NEAR, а для обычных слов - минимальное расстояние
+        между разными словами запроса
+        """
+        distinct_words = list(dict.fromkeys(query_words))
+        reranked = []
+        for doc_id, score in results:
+            if cancel_event is not None and cancel_event.is_set():
+                return []
+
+            positions = self.doc_positions[doc_id]
+            matches = 0
+            for phrase in phrases:
+                count = phrase_matches(positions, phrase)
+                if not count:
+                    break
+                matches += count
+            else:
+                for left, right, distance in near_clauses:
+                    count = near_matches(positions.get(left), positions.get(right), distance)
+                    if not count:
+                        break
+                    matches += count
+                else:
+                    proximity = math.log1p(matches)
+                    gap = min_gap(positions, distinct_words)
+                    if gap is not None:
+                        proximity += 1 / gap
+                    reranked.append((doc_id, score * (1 + PROXIMITY_BOOST * proximity)))
+
+        reranked.sort(key=lambda x: -x[1])
+        return reranked
+
+    def _search_bm25(self, term_weights, top_k=None, cancel_event=None):
+        """
+        Okapi BM25: обходит только списки postings терминов запроса,
+        длины заметок и средняя длина уже посчитаны заранее
+        """
+        total_docs = self.total_docs
+        avg_length = self.avg_doc_length
+        if not total_docs or not avg_length:
+            return []
+
+        scores = {}
+        for term, query_weight in term_weights.items():
+            if cancel_event is not None and cancel_event.is_set():
+                return []
+
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+
+            doc_freq = len(postings)
+            idf = math.log(1 + (total_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+            for doc_id, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / avg_length)
+                score = query_weight * idf * tf * (BM25_K1 + 1) / (tf + norm)
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+
+        if top_k is not None:
+            return heapq.nlargest(top_k, scores.items(), key=lambda x: x[1])
+        return sorted(scores.items(), key=lambda x: -x[1])
+
+
+def parse_query(query):
+    """
+    Выделяет из запроса фразы в кавычках и условия NEAR/k
+    :return: (список фраз, список (левое слово, правое слово, k), остаток запроса)
+    """
+    phrases = PHRASE_RE.findall(query)
+    query = PHRASE_RE.sub(' ', query)
+    near_clauses = [(left, right, int(distance)) for left, distance, right in NEAR_RE.findall(query)]
+    query = NEAR_RE.sub(' ', query)
+    return phrases, near_clauses, query
+
+
+def phrase_matches(positions, phrase):
+    """
+    Число вхождений фразы: пересечение списков позиций её слов со сдвигом
+    :param positions: термин -> позиции в заметке
+    :param phrase: список терминов фразы
+    """
+    term_positions = [positions.get(term) for term in phrase]
+    if not all(term_positions):
+        return 0
+    if len(phrase) == 1:
+        return len(term_positions[0])
+
+    # Начинаем с самого короткого списка, остальные проверяем по множествам
+    rarest = min(range(len(phrase)), key=lambda i: len(term_positions[i]))
+    others = [(i - rarest, set(term_positions[i])) for i in range(len(phrase)) if i != rarest]
+    return sum(
+        1 for start in term_positions[rarest]
+        if all(start + offset in others_set for offset, others_set in others)
+    )
+
+
+def near_matches(left_positions, right_positions, distance):
+    """
+    Число позиций левого слова, рядом с которыми (не дальше distance слов) есть правое слово.
+    Оба списка позиций отсортированы, поэтому хватает одного прохода двумя указателями.
+    """
+    if not left_positions or not right_positions:
+        return 0
+
+    count = 0
+    j = 0
+    for position in left_positions:
+        while j < len(right_positions) and right_positions[j] < position - distance:
+            j += 1
+        if j == len(right_positions):
+            break
+        if right_positions[j] <= position + distance:
+            count += 1
+    return count
+
+
+def min_gap(positions, words):
+    """
+    Минимальное расстояние (в словах) между соседними вхождениями разных слов запроса
+    :return: расстояние или None, если в заметке меньше двух разных слов запроса
+    """
+    occurrences = sorted(
+        (position, term) for term in words if term in positions for position in positions[term]
+    )
+    best = None
+    for (position, term), (next_position, next_term) in zip(occurrences, occurrences[1:]):
+        if term != next_term:
+            gap = next_position - position
+            if best is None or gap < best:
+                best = gap
+    return best
+
+
+def plain_text_with_offsets(text):
+    """
+    Текст заметки без разметки (слова через пробел) и смещения начала каждого слова.
+    Слова совпадают по порядку с потоком токенов utils.tokenize, поэтому позиция
+    термина в индексе - это номер слова в этом тексте.
+    """
+    words = utils.markdown_words(text)
+    offsets = array('I')
+    position = 0
+    for word in words:
+        offsets.append(position)
+        position += len(word) + 1
+    return ' '.join(words), offsets
+
+
+def best_window_start(hits, window):
+    """
+    Начало окна из window слов, в котором больше всего разных терминов запроса
+    (при равенстве - больше всего вхождений)
+    :param hits: отсортированный список (позиция, термин)
+    """
+    if not hits:
+        return 0
+
+    best_start, best_key = 0, None
+    counts = Counter()
+    left = 0
+    for right, (position, term) in enumerate(hits):
+        counts[term] += 1
+        while hits[left][0] <= position - window:
+            left_term = hits[left][1]
+            counts[left_term] -= 1
+            if not counts[left_term]:
+                del counts[left_term]
+            left += 1
+        key = (len(counts), right - left + 1)
+        if best_key is None or key > best_key:
+            best_key = key
+            best_start = hits[left][0]
+
+    # Немного контекста перед первым совпадением
+    return max(0, best_start - window // 4)
+
+
+def iter_note_files(vault_dir):
+    """
+    Перебирает пути ко всем заметкам (.json) хранилища
+    """
+    for root, _, files in os.walk(vault_dir):
+        for file in files:
+            if file.endswith('.json'):
+                yield os.path.join(root, file)
+
+
+def file_fingerprint(filepath):
+    """
+    Отпечаток файла для обнаружения изменений без чтения содержимого
+    :return: (mtime в наносекундах, размер) или None, если файл недоступен
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def read_note_text(filepath):
+    """
+    Читает текст заметки из JSON файла.
+    :return: текст заметки или None, если файл не удалось прочитать
+    """
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"Error reading {filepath}: {e}")
+        return None
+
+    if isinstance(data, dict) and 'text' in data:
+        return data['text']
+    return None
@@ -0,0 +1,138 @@
+import math
+
+
+DEFAULT_CELL_SIZE = 32  # сторона ячейки сетки в пикселях
+
+
+class StrokeGrid:
+    """
+    Пространственный индекс отрезков штрихов на равномерной сетке.
+
+    Каждый отрезок (пара соседних точек штриха) записывается во все ячейки,
+    которые пересекает его ограничивающий прямоугольник. Запрос по кругу или
+    отрезку стирания смотрит только ячейки рядом с ним, поэтому стоимость
+    стирания не зависит от общего числа штрихов заметки.
+    Штрихи - словари рисунков из drawing_data, ключ - id словаря.
+    """
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> {id штриха: множество номеров отрезков}
+        self.strokes = {}  # id штриха -> (штрих, число проиндексированных точек, ячейки штриха)
+
+    def __len__(self):
+        return len(self.strokes)
+
+    def __contains__(self, drawing):
+        return id(drawing) in self.strokes
+
+    def clear(self):
+        self.cells = {}
+        self.strokes = {}
+
+    def sync(self, drawings):
+        """
+        Приводит индекс к списку штрихов: новые добавляются, исчезнувшие удаляются.
+        Работает по числу штрихов, точки уже проиндексированных штрихов не перебираются
+        """
+        current = {id(drawing): drawing for drawing in drawings}
+        for key in [key for key in self.strokes if key not in current]:
+            self.remove_stroke(self.strokes[key][0])
+        for key, drawing in current.items():
+            if key not in self.strokes:
+                self.add_stroke(drawing)
+
+    def add_stroke(self, drawing):
+        self.strokes[id(drawing)] = (drawing, 0, set())
+        self.extend_stroke(drawing)
+
+    def extend_stroke(self, drawing):
+        """
+        Индексирует точки, добавленные в конец штриха после предыдущего вызова
+        """
+        key = id(drawing)
+        if key not in self.strokes:
+            self.add_stroke(drawing)
+            return
+
+        _, indexed, stroke_cells = self.strokes[key]
+        points = drawing['points']
+        count = len(points) // 2
+        if count == indexed:
+            return
+
+        if count == 1:
+            # Штрих из одной точки - вырожденный отрезок 0
+            self._insert(key, 0, points[0], points[1], points[0], points[1], stroke_cells)
+        else:
+            # Отрезок 0 переиндексируется, если раньше штрих был одной точкой
+            for segment in range(max(indexed - 1, 0), count - 1):
+                i = segment * 2
+                self._insert(key, segment, points[i], points[i + 1], points[i + 2], points[i + 3], stroke_cells)
+        self.strokes[key] = (drawing, count, stroke_cells)
+
+    def remove_stroke(self, drawing):
+        entry = self.strokes.pop(id(drawing), None)
+        if entry is None:
+            return
+        key = id(drawing)
+        for cell in entry[2]:
+            bucket = self.cells.get(cell)
+            if bucket is None:
+                continue
+            bucket.pop(key, None)
+            if not bucket:
+                del self.cells[cell]
+
+    def query_rect(self, x_min, y_min, x_max, y_max):
+        """
+        Отрезки, ограничивающие прямоугольники которых попадают в ячейки прямоугольника
+        :return: {id штриха: (штрих, множество номеров отрезков)}
+        """
+        result = {}
+        cx_min, cy_min = self._cell(x_min, y_min)
+        cx_max, cy_max = self._cell(x_max, y_max)
+        for cx in range(cx_min, cx_max + 1):
+            for cy in range(cy_min, cy_max + 1):
+                bucket = self.cells.get((cx, cy))
+                if not bucket:
+                    continue
+                for key, segments in bucket.items():
+                    if key not in result:
+                        result[key] = (self.strokes[key][0], set())
+                    result[key][1].update(segments)
+        return result
+
+    def query_circle(self, x, y, radius):
+        return self.query_rect(x - radius, y - radius, x + radius, y + radius)
+
+    def query_segment(self, x1, y1, x2, y2, radius):
+        return self.query_rect(min(x1, x2) - radius, min(y1, y2) - radius,
+                               max(x1, x2) + radius, max(y1, y2) + radius)
+
+    def _cell(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def _segment_cells(self, x1, y1, x2, y2):
+        cx_min, cy_min = self._cell(min(x1, x2), min(y1, y2))
+        cx_max, cy_max = self._cell(max(x1, x2), max(y1, y2))
+        for cx in range(cx_min, cx_max + 1):
+            for cy in range(cy_min, cy_max + 1):
+                yield cx, cy
+
+    def _insert(self, key, segment, x1, y1, x2, y2, stroke_cells):
+        for cell in self._segment_cells(x1, y1, x2, y2):
+            self.cells.setdefault(cell, {}).setdefault(key, set()).add(segment)
+            stroke_cells.add(cell)
+
+
+def point_segment_distance(px, py, x1, y1, x2, y2):
+    """
+    Расстояние от точки до отрезка
+    """
+    dx = x2 - x1
+    dy = y2 - y1
+    length = dx * dx + dy * dy
+    if length == 0:
+        return math.hypot(px - x1, py - y1)
+    t = max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length))
+    return math.hypot(px - x1 - t * dx, py - y1 - t * dy)
@@ -0,0 +1,117 @@
+import os
+
+import torch
+from transformers import MT5ForConditionalGeneration, MT5TokenizerFast
+
+
+class TorchBackend:
+    """
+    Исходный вариант: MT5 в полной точности в PyTorch (GPU, если есть)
+    """
+    name = 'torch'
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.tokenizer = None
+        self.model = None
+        self.device = torch.device('cpu')
+
+    def load(self, tokenizer=None):
+        """
+        :param tokenizer: уже загруженный токенизатор модели (иначе загружается здесь)
+        """
+        self.tokenizer = tokenizer or MT5TokenizerFast.from_pretrained(self.model_path)
+        self.model = MT5ForConditionalGeneration.from_pretrained(self.model_path)
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model = self.model.to(self.device)
+        self.model.eval()
+
+    def unload(self):
+        self.model = None
+        self.tokenizer = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def generate(self, input_ids, attention_mask, **generation_kwargs):
+        with torch.inference_mode():
+            return self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                **generation_kwargs
+            )
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """
+    PyTorch с динамической int8 квантизацией линейных слоев (только CPU).
+    Веса Linear хранятся в int8, активации квантуются на лету.
+    """
+    name = 'torch-int8'
+
+    def load(self, tokenizer=None):
+        self.tokenizer = tokenizer or MT5TokenizerFast.from_pretrained(self.model_path)
+        model = MT5ForConditionalGeneration.from_pretrained(self.model_path)
+        model.eval()
+        self.device = torch.device('cpu')
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime: энкодер и декодер экспортируются через optimum,
+    декодер использует KV-кэш (use_cache=True), только CPU.
+    Нужны пакеты optimum[onnxruntime] и onnxruntime, они не входят в requirements.txt:
+    pip install -r requirements-onnx.txt
+    Экспортированная модель сохраняется в <model_path>-onnx и при следующем запуске
+    загружается без повторного экспорта.
+    """
+    name = 'onnx'
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.onnx_path = model_path.rstrip('/\\') + '-onnx'
+        self.tokenizer = None
+        self.model = None
+        self.device = torch.device('cpu')
+
+    def load(self, tokenizer=None):
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        except ImportError as e:
+            raise RuntimeError("Для ONNX Runtime установите optimum[onnxruntime]: "
+                               "pip install -r requirements-onnx.txt") from e
+
+        self.tokenizer = tokenizer or MT5TokenizerFast.from_pretrained(self.model_path)
+        if os.path.isdir(self.onnx_path):
+            self.model = ORTModelForSeq2SeqLM.from_pretrained(self.onnx_path, use_cache=True)
+        else:
+            print("[Summarizer] Экспорт модели в ONNX...")
+            self.model = ORTModelForSeq2SeqLM.from_pretrained(self.model_path, export=True, use_cache=True)
+            self.model.save_pretrained(self.onnx_path)
+
+    def unload(self):
+        self.model = None
+        self.tokenizer = None
+
+    def generate(self, input_ids, attention_mask, **generation_kwargs):
+        return self.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            **generation_kwargs
+        )
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    QuantizedTorchBackend.name: QuantizedTorchBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def create_backend(name, model_path):
+    """
+    Создает бэкенд инференса по имени ('torch', 'torch-int8', 'onnx')
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд суммаризации: {name}")
+    return BACKENDS[name](model_path)
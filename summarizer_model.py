@@ -1,130 +1,586 @@
-import torch
-from transformers import MT5ForConditionalGeneration, MT5Tokenizer
-from threading import Thread
-from queue import Queue
+import gc
+import itertools
+import time
+from threading import Thread, Event, Lock
+from queue import PriorityQueue, Empty
+
+from kivy.clock import Clock
+
+import extractive_summary
+from summary_cache import SummaryCache
+from text_chunker import TokenChunker
+
+
+# Приоритеты задач: чем меньше число, тем раньше задача попадет в обработку
+PRIORITY_STOP = -1
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# Состояния модели: загружается при первом запросе и выгружается после простоя
+MODEL_UNLOADED = 'unloaded'
+MODEL_LOADING = 'loading'
+MODEL_READY = 'ready'
+MODEL_ERROR = 'error'
+
+ERROR_PREFIX = "[Ошибка]"  # так начинается результат задачи, завершившейся ошибкой
+
+_job_ids = itertools.count(1)
+
+TASK_PREFIX = "simplify |"
+MAX_INPUT_LENGTH = 512
+DEFAULT_MAX_BATCH_SIZE = 4  # сколько частей текста обрабатывается одним вызовом generate
+DEFAULT_IDLE_TIMEOUT = 600  # через сколько секунд без задач выгружать модель (None - не выгружать)
+IDLE_CHECK_INTERVAL = 5  # как часто поток обработки проверяет простой, секунды
+DEFAULT_CHUNK_OVERLAP = 0  # сколько токенов последних предложений части повторять в начале следующей
+BUSY_JOB_COUNT = 2  # при стольких незавершенных задачах модель считается занятой
+MAX_REDUCE_LEVELS = 4  # сколько раз можно заново суммаризировать объединенные суммаризации частей
+GENERATION_KWARGS = {
+    'max_length': 256,
+    'min_length': 128,
+    'num_beams': 4,
+    'length_penalty': 0.7,
+    'no_repeat_ngram_size': 3,
+    'early_stopping': True,
+}
+
+
+class SummaryJob:
+    """
+    Дескриптор задачи суммаризации (аналог future).
+    У каждой задачи свой номер и свой канал результата (result + событие),
+    поэтому параллельные запросы не получают чужие результаты.
+    Колбэки вызываются в потоке интерфейса через Clock.schedule_once.
+    """
+    def __init__(self, text, on_done=None, on_progress=None, priority=PRIORITY_INTERACTIVE, on_partial=None):
+        self.job_id = next(_job_ids)
+        self.priority = priority
+        self.text = text
+        self.on_done = on_done  # on_done(summary)
+        self.on_progress = on_progress  # on_progress(обработано частей, всего частей)
+        self.on_partial = on_partial  # on_partial(текст суммаризации готовых начальных частей)
+        self.result = None
+        self._cancelled = Event()
+        self._finished = Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        return self._finished.is_set()
+
+    def cancel(self):
+        """
+        Отменяет задачу: оставшиеся части текста не обрабатываются, on_done не вызывается
+        """
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        """
+        Блокирующее ожидание результата (не вызывать из потока интерфейса)
+        """
+        self._finished.wait(timeout)
+        return self.result
+
+    def _report_progress(self, processed, total):
+        if self.on_progress and not self.cancelled:
+            Clock.schedule_once(lambda dt: self.on_progress(processed, total))
+
+    def _report_partial(self, text):
+        if self.on_partial and not self.cancelled:
+            Clock.schedule_once(lambda dt: self.on_partial(text))
+
+    def _finish(self, result):
+        self.result = result
+        self._finished.set()
+        if self.on_done and not self.cancelled:
+            Clock.schedule_once(lambda dt: self.on_done(result))
+
+
+class _ActiveJob:
+    """
+    Состояние задачи в обработке: части текста и уже готовые суммаризации частей.
+    level - уровень map-reduce: 0 - части исходного текста, дальше - части
+    объединенных суммаризаций предыдущего уровня
+    """
+    def __init__(self, job, encoded_chunks):
+        self.job = job
+        self.level = -1
+        self.start_level(encoded_chunks)
+
+    def start_level(self, encoded_chunks):
+        """
+        :param encoded_chunks: список (часть текста, номера токенов части)
+        """
+        self.level += 1
+        chunks = [chunk for chunk, _ in encoded_chunks]
+        self.chunks = chunks
+        self.chunk_ids = [ids for _, ids in encoded_chunks]
+        self.summaries = [None] * len(chunks)
+        self.pending = list(range(len(chunks)))  # номера частей, которые ещё нужно суммаризировать
+        self.streamed = 0  # сколько начальных частей уже отправлено в on_partial
+
+    def set_summary(self, index, summary):
+        self.summaries[index] = summary
+        self.pending.remove(index)
+
+    def ready_prefix(self):
+        """
+        Число начальных частей подряд, для которых суммаризация уже готова
+        """
+        count = 0
+        while count < len(self.summaries) and self.summaries[count] is not None:
+            count += 1
+        return count
 
 
 class TextSummarizer:
-    def __init__(self, model_path):
-        print("[Summarizer] Инициализация модели...")
+    """
+    Суммаризатор с ленивой загрузкой модели.
+    При создании torch/transformers не импортируются и модель не загружается:
+    это происходит при первом запросе, части которого нет в кэше (или в warm_up),
+    а после idle_timeout секунд без задач модель выгружается из памяти.
+    Для разбивки текста на части и поиска в кэше нужен только токенизатор.
+    """
+    def __init__(self, model_path, max_batch_size=DEFAULT_MAX_BATCH_SIZE, cache=None, backend='torch',
+                 chunk_overlap=DEFAULT_CHUNK_OVERLAP, idle_timeout=DEFAULT_IDLE_TIMEOUT, on_state_change=None,
+                 map_reduce=True):
         #0odel_path = r"alan-turing-institute/mt5-small-finetuned-mnli-xtreme-xnli"
         self.model_path = model_path
-        self.task_queue = Queue()
-        self.result_queue = Queue()
-        self.ready = False
+        self.max_batch_size = max_batch_size
+        self.cache = cache  # SummaryCache или None
+        self.backend_name = backend  # 'torch', 'torch-int8' или 'onnx'
+        self.backend = None  # создается при загрузке модели
+        self.chunk_overlap = chunk_overlap
+        self.tokenizer = None
+        self.prefix_ids = []
+        self.chunker = None
+        self.tokenizer_lock = Lock()
+        # map-reduce: суммаризации частей объединяются и суммаризируются снова, пока не уместятся в одно окно
+        self.map_reduce = map_reduce
+        self.idle_timeout = idle_timeout
+        self.on_state_change = on_state_change  # on_state_change(состояние), в потоке интерфейса
+        self.state = MODEL_UNLOADED
+        self.load_lock = Lock()
+        self.last_used = time.monotonic()
+        self.task_queue = PriorityQueue()  # (приоритет, номер задачи, задача)
+        self.jobs = {}  # номер задачи -> SummaryJob, пока задача не завершена
+        self.jobs_lock = Lock()
         self.stop_flag = False  # Флаг для остановки потока
 
-        # Запуск потока для инициализации модели
-        self.init_thread = Thread(target=self._initialize_in_thread, daemon=True)
-        self.init_thread.start()
-
-        # Поток для обработки задач
+        # Поток для обработки задач (модель в нем загружается по первой задаче)
         self.process_thread = Thread(target=self._process_in_thread, daemon=True)
         self.process_thread.start()
 
-    def _initialize_in_thread(self):
+    @property
+    def ready(self):
+        return self.state == MODEL_READY
+
+    def _set_state(self, state):
+        self.state = state
+        if self.on_state_change:
+            Clock.schedule_once(lambda dt: self.on_state_change(state))
+
+    def warm_up(self):
         """
-        Инициализация модели в потоке
+        Загружает модель заранее в фоновом потоке (например, когда приложение простаивает)
         """
-        try:
-            self.tokenizer = MT5Tokenizer.from_pretrained(self.model_path)
-            self.model = MT5ForConditionalGeneration.from_pretrained(self.model_path)
-            self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-            self.model = self.model.to(self.device)
-            self.ready = True
+        if self.state in (MODEL_UNLOADED, MODEL_ERROR):
+            Thread(target=self.load, daemon=True).start()
 
-            print("[Summarizer] Модель загружена и готова к работе!")
-        except Exception as e:
-            print("[Summarizer] Ошибка загрузки модели: 1")
-            self.ready = False
+    def load(self):
+        """
+        Загружает модель, если она еще не загружена (блокирующий, не для потока интерфейса)
+        :return: True, если модель готова к работе
+        """
+        with self.load_lock:
+            if self.state == MODEL_READY:
+                return True
+
+            print("[Summarizer] Инициализация модели...")
+            self._set_state(MODEL_LOADING)
+            try:
+                # torch/transformers импортируются только здесь, а не при запуске приложения
+                from summarizer_backends import create_backend
+
+                if not self.load_tokenizer():
+                    return False
+                backend = create_backend(self.backend_name, self.model_path)
+                backend.load(self.tokenizer)
+                self.backend = backend
+                self.device = backend.device
+                self.last_used = time.monotonic()
+                self._set_state(MODEL_READY)
+
+                print(f"[Summarizer] Модель загружена и готова к работе! (бэкенд {self.backend_name})")
+                return True
+            except Exception as e:
+                print(f"[Summarizer] Ошибка загрузки модели: {e}")
+                self.backend = None
+                self._set_state(MODEL_ERROR)
+                return False
+
+    def load_tokenizer(self):
+        """
+        Загружает только токенизатор (без модели) и создает по нему разбивку на части.
+        Токенизатор небольшой, поэтому при выгрузке модели он остается в памяти.
+        Быстрый токенизатор из spiece.model (модель сохранена без tokenizer.json)
+        конвертируется при загрузке, для этого нужен пакет protobuf
+        :return: True, если токенизатор готов; при ошибке модель переходит в состояние MODEL_ERROR
+        """
+        with self.tokenizer_lock:
+            if self.chunker is not None:
+                return True
+            try:
+                from transformers import MT5TokenizerFast
+
+                tokenizer = MT5TokenizerFast.from_pretrained(self.model_path)
+                # Префикс задачи и завершающий токен </s> занимают часть окна модели
+                prefix_ids = tokenizer(TASK_PREFIX, add_special_tokens=False)['input_ids']
+                chunker = TokenChunker(tokenizer, MAX_INPUT_LENGTH - len(prefix_ids) - 1, self.chunk_overlap)
+            except Exception as e:
+                print(f"[Summarizer] Ошибка загрузки токенизатора: {e}")
+                self._set_state(MODEL_ERROR)
+                return False
+            self.prefix_ids = prefix_ids
+            self.chunker = chunker
+            self.tokenizer = tokenizer
+            return True
+
+    def unload(self):
+        """
+        Выгружает модель из памяти, следующий запрос загрузит ее снова
+        """
+        with self.load_lock:
+            if self.state != MODEL_READY:
+                return
+            self.backend.unload()
+            self.backend = None
+            gc.collect()
+            self._set_state(MODEL_UNLOADED)
+            print("[Summarizer] Модель выгружена после простоя")
+
+    def summarize(self, text, priority=PRIORITY_INTERACTIVE):
+        """
+        Публичный метод для запроса суммаризации (блокирующий, не для потока интерфейса)
+        """
+        return self.submit(text, priority=priority).wait()  # Блокируется, пока не получит результат
+
+    @property
+    def busy(self):
+        """
+        Занята ли модель: в очереди и в работе уже несколько задач
+        """
+        with self.jobs_lock:
+            return len(self.jobs) >= BUSY_JOB_COUNT
+
+    def summarize_extractive(self, text):
+        """
+        Мгновенная извлекающая суммаризация (TextRank по предложениям, без модели).
+        Подходит, пока модель загружается или занята, и для быстрого предпросмотра
+        """
+        return extractive_summary.summarize(text)
 
-    def summarize(self, text):
+    def summarize_async(self, text, on_done=None, on_progress=None, on_partial=None):
         """
-        Публичный метод для запроса суммаризации
+        Неблокирующий запрос суммаризации.
+        :param text: текст для суммаризации
+        :param on_done: вызывается в потоке интерфейса с готовым текстом
+        :param on_progress: вызывается в потоке интерфейса после каждой части (обработано, всего)
+        :param on_partial: потоковый вывод - вызывается в потоке интерфейса с суммаризацией
+            уже готовых начальных частей, как только их становится больше
+        :return: SummaryJob - через него можно отменить задачу
         """
-        if not self.ready:
-            return "[Ошибка] Модель еще не загружена!"
+        return self.submit(text, on_done, on_progress, PRIORITY_INTERACTIVE, on_partial)
 
-        print("[Summarizer] Добавление задачи в очередь")
-        self.task_queue.put(text)
-        return self.result_queue.get()  # Блокируется, пока не получит результат
+    def summarize_batch(self, texts, on_done=None):
+        """
+        Фоновая суммаризация нескольких текстов (например, всех заметок папки).
+        Интерактивные запросы обгоняют задачи пакета в очереди.
+        :param texts: список текстов
+        :param on_done: вызывается в потоке интерфейса для каждого текста: on_done(номер текста, суммаризация)
+        :return: список SummaryJob в порядке текстов
+        """
+        jobs = []
+        for i, text in enumerate(texts):
+            callback = (lambda summary, i=i: on_done(i, summary)) if on_done else None
+            jobs.append(self.submit(text, callback, priority=PRIORITY_BATCH))
+        return jobs
+
+    def submit(self, text, on_done=None, on_progress=None, priority=PRIORITY_INTERACTIVE, on_partial=None):
+        """
+        Ставит задачу в очередь с приоритетом
+        :return: SummaryJob
+        """
+        job = SummaryJob(text, on_done, on_progress, priority, on_partial)
+        with self.jobs_lock:
+            stopped = self.stop_flag
+            if not stopped:
+                self.jobs[job.job_id] = job
+        if stopped:
+            # Поток обработки остановлен: задача сразу завершается как отмененная
+            job.cancel()
+            job._finish(None)
+            return job
+        print(f"[Summarizer] Задача {job.job_id} добавлена в очередь (приоритет {priority})")
+        self.task_queue.put((priority, job.job_id, job))
+        return job
+
+    def get_job(self, job_id):
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Отменяет задачу по номеру
+        """
+        job = self.get_job(job_id)
+        if job is not None:
+            job.cancel()
+
+    def _route_result(self, job_id, result):
+        """
+        Передает результат в канал задачи с этим номером
+        """
+        self.last_used = time.monotonic()
+        with self.jobs_lock:
+            job = self.jobs.pop(job_id, None)
+        if job is not None:
+            job._finish(result)
 
     def _process_in_thread(self):
         """
         Основной цикл обработки задач.
+        Части текстов собираются в пакеты до max_batch_size и обрабатываются
+        одним вызовом generate. Если частей текущей задачи не хватает на полный пакет,
+        в него добираются части следующих задач из очереди (в порядке приоритета).
+        Задача с более высоким приоритетом берется сразу, даже если пакет заполнен,
+        и ее части идут в пакеты раньше частей фоновых задач.
+        Части, уже суммаризированные раньше, берутся из кэша и в пакет не попадают.
+        После остановки все незавершенные задачи завершаются как отмененные.
         """
+        active = []  # задачи в работе (_ActiveJob)
+        stopping = False
+
         while not self.stop_flag:
-            try:
-                text = self.task_queue.get()
-                if text is None:  # Сигнал остановки
+            if not active:
+                if self.cache is not None:
+                    self.cache.flush()
+                if stopping:
                     break
+                try:
+                    timeout = IDLE_CHECK_INTERVAL if self.idle_timeout is not None else None
+                    _, job_id, job = self.task_queue.get(timeout=timeout)
+                except Empty:
+                    if self.ready and time.monotonic() - self.last_used >= self.idle_timeout:
+                        self.unload()
+                    continue
+                if job is None:  # Сигнал остановки
+                    break
+                self._activate_job(job, active)
+                continue
 
-                print("[Summarizer] Обработка текста длиной символов")
+            # Добираем задачи из очереди, пока в пакете есть свободные места
+            # или пока в очереди есть задачи важнее обрабатываемых
+            while not stopping and (sum(len(state.pending) for state in active) < self.max_batch_size
+                                    or self._has_priority_job(min(state.job.priority for state in active))):
+                try:
+                    _, job_id, job = self.task_queue.get_nowait()
+                except Empty:
+                    break
+                if job is None:
+                    stopping = True  # Дообрабатываем взятые задачи и выходим
+                    break
+                self._activate_job(job, active)
 
-                # Разбивка текста на части (~500 токенов)
-                chunks = self._split_text(text)
-                summaries = []
+            active = [state for state in active if not self._drop_if_cancelled(state)]
+            if not active:
+                continue
+            active.sort(key=lambda state: state.job.priority)  # сортировка устойчивая: порядок поступления сохраняется
 
-                for i, chunk in enumerate(chunks):
-                    print("[Summarizer] Обработка части")
-                    summary = self._summarize_chunk(chunk)
-                    summaries.append(summary)
+            batch = []  # (состояние задачи, номер части)
+            first = active[0]
+            if first.job.on_partial and first.level == 0 and first.pending and first.pending[0] == 0:
+                # Первая часть потоковой задачи идет отдельно, чтобы текст появился
+                # через время одной части, а не целого пакета
+                batch.append((first, 0))
+            else:
+                for state in active:
+                    for index in state.pending[:self.max_batch_size - len(batch)]:
+                        batch.append((state, index))
 
-                full_summary = " ".join(summaries)
-                self.result_queue.put(full_summary)
+            if not self.load():
+                # Модель нужна только для частей, которых нет в кэше
+                for state in active:
+                    self._route_result(state.job.job_id, f"{ERROR_PREFIX} Не удалось загрузить модель!")
+                active = []
+                continue
 
+            try:
+                batch_summaries = self._summarize_batch([state.chunk_ids[index] for state, index in batch])
             except Exception as e:
                 print("[Summarizer] Ошибка обработки 2")
-                self.result_queue.put(f"[Ошибка] {str(e)}")
+                for state in {id(state): state for state, _ in batch}.values():
+                    self._route_result(state.job.job_id, f"{ERROR_PREFIX} {str(e)}")
+                    active.remove(state)
+                continue
+
+            for (state, index), summary in zip(batch, batch_summaries):
+                state.set_summary(index, summary)
+                if self.cache is not None:
+                    self.cache.put(self._cache_key(state.chunks[index]), summary)
 
-    def _split_text(self, text, max_tokens=1024):
+            for state in {id(state): state for state, _ in batch}.values():
+                self._report_or_finish(state, active)
+
+        self._cancel_outstanding()
+        if self.cache is not None:
+            self.cache.flush()
+
+    def _has_priority_job(self, priority):
         """
-        Разбивает текст на части по предложениям
+        Есть ли в очереди задача с более высоким приоритетом (меньшим числом)
         """
-        sentences = text.split('. ')
-        chunks = []
-        current_chunk = ""
+        with self.task_queue.mutex:
+            return bool(self.task_queue.queue) and self.task_queue.queue[0][0] < priority
 
-        for sent in sentences:
-            if len(current_chunk.split()) + len(sent.split()) <= max_tokens:
-                current_chunk += sent + ". "
-            else:
-                chunks.append(current_chunk)
-                current_chunk = sent + ". "
+    def _cancel_outstanding(self):
+        """
+        Завершает задачи в очереди и в работе результатом отмены (None),
+        чтобы wait() не ждал вечно после остановки
+        """
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+            self.jobs.clear()
+        for job in jobs:
+            job.cancel()
+            job._finish(None)
+        if jobs:
+            print(f"[Summarizer] Отменено незавершенных задач при остановке: {len(jobs)}")
+
+    def _activate_job(self, job, active):
+        """
+        Разбивает текст задачи на части, подставляет части из кэша
+        и добавляет задачу в список обрабатываемых.
+        Модель здесь не загружается: если все части есть в кэше, она не нужна
+        """
+        if job.cancelled:
+            self._route_result(job.job_id, None)
+            return
+
+        if not self.load_tokenizer():
+            self._route_result(job.job_id, f"{ERROR_PREFIX} Не удалось загрузить модель!")
+            return
+
+        print(f"[Summarizer] Обработка задачи {job.job_id}")
+        try:
+            # Разбивка текста на части по длине входа модели
+            state = _ActiveJob(job, self._split_text(job.text))
+        except Exception as e:
+            print("[Summarizer] Ошибка обработки 2")
+            self._route_result(job.job_id, f"{ERROR_PREFIX} {str(e)}")
+            return
+
+        self._fill_from_cache(state)
+        active.append(state)
+        self._report_or_finish(state, active)
 
-        if current_chunk:
-            chunks.append(current_chunk)
+    def _fill_from_cache(self, state):
+        """
+        Подставляет суммаризации частей, уже сохраненные в кэше
+        """
+        if self.cache is None:
+            return
+        for index in list(state.pending):
+            summary = self.cache.get(self._cache_key(state.chunks[index]))
+            if summary is not None:
+                state.set_summary(index, summary)
+        cached = len(state.chunks) - len(state.pending)
+        if cached:
+            print(f"[Summarizer] Частей из кэша: {cached} из {len(state.chunks)}")
+
+    def _report_or_finish(self, state, active):
+        job = state.job
+        while not state.pending:
+            summary = " ".join(state.summaries)
+            if not self.map_reduce or len(state.chunks) == 1 or state.level == MAX_REDUCE_LEVELS:
+                self._route_result(job.job_id, summary)
+                active.remove(state)
+                return
+
+            # reduce: объединенные суммаризации снова режутся на части и идут в те же пакеты,
+            # пока весь текст не уместится в одно окно модели
+            try:
+                state.start_level(self._split_text(summary))
+            except Exception as e:
+                print("[Summarizer] Ошибка обработки 2")
+                self._route_result(job.job_id, f"{ERROR_PREFIX} {str(e)}")
+                active.remove(state)
+                return
+            print(f"[Summarizer] Задача {job.job_id}: уровень {state.level}, частей {len(state.chunks)}")
+            self._fill_from_cache(state)
 
-        print("[Summarizer] Текст разбит на {len(chunks)} частей")
+        job._report_progress(len(state.chunks) - len(state.pending), len(state.chunks))
+        # Части идут в пакеты по порядку, поэтому готовое начало текста растет с каждым пакетом.
+        # Промежуточные уровни map-reduce в окно не выводятся
+        ready = state.ready_prefix()
+        if state.level == 0 and ready > state.streamed:
+            state.streamed = ready
+            job._report_partial(" ".join(state.summaries[:ready]))
+
+    def _drop_if_cancelled(self, state):
+        job = state.job
+        if job.cancelled:
+            print(f"[Summarizer] Задача {job.job_id} отменена")
+            self._route_result(job.job_id, None)
+            return True
+        return False
+
+    def _cache_key(self, chunk):
+        # Бэкенды дают немного разный текст, поэтому бэкенд входит в ключ
+        return SummaryCache.make_key(
+            chunk, [self.model_path, self.backend_name], [TASK_PREFIX, MAX_INPUT_LENGTH, GENERATION_KWARGS]
+        )
+
+    def _split_text(self, text):
+        """
+        Разбивает текст на части по предложениям так, чтобы каждая часть
+        вместе с префиксом задачи помещалась в MAX_INPUT_LENGTH токенов
+        :return: список (часть текста, номера токенов части)
+        """
+        chunks = self.chunker.split_encoded(text)
+        print(f"[Summarizer] Текст разбит на {len(chunks)} частей")
         return chunks
 
-    def _summarize_chunk(self, text):
+    def _summarize_batch(self, chunk_ids):
         """
-        Суммаризация одной части текста
+        Суммаризация нескольких частей текста одним вызовом generate
+        (входы дополняются паддингом до самой длинной части пакета).
+        Части уже токенизированы при разбивке, здесь к ним только добавляются
+        префикс задачи и завершающий токен
+        :param chunk_ids: номера токенов каждой части
         """
-        inputs = self.tokenizer(
-            "simplify |" + text,
-            return_tensors="pt",
-            truncation=True,
-            max_length=512
+        eos = [self.tokenizer.eos_token_id]
+        inputs = self.tokenizer.pad(
+            {"input_ids": [(self.prefix_ids + ids)[:MAX_INPUT_LENGTH - 1] + eos for ids in chunk_ids]},
+            padding=True,
+            return_tensors="pt"
         ).to(self.device)
 
-        summary_ids = self.model.generate(
-            input_ids=inputs["input_ids"],
-            attention_mask=inputs["attention_mask"],
-            max_length=256,
-            min_length=128,
-            num_beams=4,
-            length_penalty=0.7,
-            no_repeat_ngram_size=3,
-            early_stopping=True
+        summary_ids = self.backend.generate(
+            inputs["input_ids"],
+            inputs["attention_mask"],
+            **GENERATION_KWARGS
         )
-        print("[Summarizer] Задача выполнена")
-        return self.tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+        print(f"[Summarizer] Пакет из {len(chunk_ids)} частей выполнен")
+        return self.tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
 
     def shutdown(self):
         """
-        Корректное завершение работы
+        Корректное завершение работы: задачи в очереди и в работе завершаются
+        как отмененные (wait вернет None), новые задачи сразу отменяются
         """
-        self.stop_flag = True
-        self.task_queue.put(None)  # Сигнал остановки
\ No newline at end of file
+        with self.jobs_lock:
+            self.stop_flag = True
+        self.task_queue.put((PRIORITY_STOP, 0, None))  # Сигнал остановки
\ No newline at end of file
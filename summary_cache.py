@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+CACHE_FILENAME = 'summary_cache.json'
+CACHE_VERSION = 1
+DEFAULT_MAX_ENTRIES = 5000
+
+
+class SummaryCache:
+    """
+    Кэш суммаризаций частей текста, сохраняемый в папке данных приложения.
+    В хранилище его класть нельзя: любой .json там считается заметкой
+    (индексируется поиском и виден в списке файлов).
+
+    Ключ - хэш текста части вместе с моделью и параметрами генерации,
+    поэтому после правки одного абзаца заново суммаризируется только его часть.
+    Старые записи вытесняются по LRU, размер кэша ограничен max_entries.
+    """
+    def __init__(self, cache_dir, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param cache_dir: папка для файла кэша (App.user_data_dir)
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILENAME)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # ключ -> суммаризация, последние использованные в конце
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def make_key(text, model_id, params):
+        """
+        Ключ записи: хэш текста части, модели и параметров генерации
+        """
+        payload = json.dumps([model_id, params, text], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Суммаризация по ключу или None. Попадание меняет порядок LRU,
+        поэтому кэш помечается измененным и порядок сохраняется при flush
+        """
+        with self.lock:
+            summary = self.entries.get(key)
+            if summary is not None:
+                self.entries.move_to_end(key)
+                self.dirty = True
+            return summary
+
+    def put(self, key, summary):
+        with self.lock:
+            self.entries[key] = summary
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != CACHE_VERSION:
+                return
+            self.entries = OrderedDict(data['entries'])
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            print(f"[SummaryCache] Загружено записей: {len(self.entries)}")
+        except Exception as e:
+            print(f"[SummaryCache] Ошибка чтения кэша: {e}")
+
+    def flush(self):
+        """
+        Сохраняет кэш на диск, если он изменился (через временный файл)
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {'version': CACHE_VERSION, 'entries': list(self.entries.items())}
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self.dirty = False
+            except Exception as e:
+                print(f"[SummaryCache] Ошибка сохранения кэша: {e}")
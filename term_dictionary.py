@@ -0,0 +1,126 @@
+import bisect
+from collections import Counter
+
+
+TRIGRAM_PADDING = '$$'
+
+
+class TermDictionary:
+    """
+    Словарь терминов хранилища для дополнения и нечёткого поиска.
+
+    - Отсортированный массив терминов: дополнение по префиксу двумя bisect,
+      без просмотра всего словаря.
+    - Триграммный индекс (триграмма -> множество терминов): кандидаты для
+      нечёткого сравнения берутся только из списков триграмм запроса,
+      и лишь для них считается ограниченное расстояние Левенштейна.
+    """
+    def __init__(self, terms=()):
+        self.terms = sorted(set(terms))
+        self.trigrams = {}
+        for term in self.terms:
+            self._add_trigrams(term)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        i = bisect.bisect_left(self.terms, term)
+        return i < len(self.terms) and self.terms[i] == term
+
+    def add(self, term):
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return
+        self.terms.insert(i, term)
+        self._add_trigrams(term)
+
+    def remove(self, term):
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return
+        del self.terms[i]
+        for trigram in term_trigrams(term):
+            bucket = self.trigrams.get(trigram)
+            if bucket is None:
+                continue
+            bucket.discard(term)
+            if not bucket:
+                del self.trigrams[trigram]
+
+    def complete(self, prefix, limit=10):
+        """
+        Термины, начинающиеся с префикса
+        :param prefix: префикс
+        :param limit: максимальное число вариантов
+        :return: список терминов в алфавитном порядке
+        """
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self.terms, prefix)
+        # '\U0010ffff' больше любого символа, поэтому граница диапазона - все слова с этим префиксом
+        end = bisect.bisect_left(self.terms, prefix + '\U0010ffff', start)
+        return self.terms[start:min(end, start + limit)]
+
+    def fuzzy(self, term, max_distance=1, limit=10):
+        """
+        Термины на расстоянии Левенштейна не больше max_distance
+        :param term: искомое слово
+        :param max_distance: допустимое число правок
+        :param limit: максимальное число вариантов
+        :return: список (термин, расстояние) по возрастанию расстояния
+        """
+        trigrams = term_trigrams(term)
+        # Одна правка затрагивает не больше трёх триграмм
+        min_shared = max(1, len(trigrams) - 3 * max_distance)
+
+        shared = Counter()
+        for trigram in set(trigrams):
+            bucket = self.trigrams.get(trigram)
+            if bucket:
+                shared.update(bucket)
+
+        matches = []
+        for candidate, count in shared.items():
+            if count < min_shared or abs(len(candidate) - len(term)) > max_distance:
+                continue
+            distance = bounded_levenshtein(term, candidate, max_distance)
+            if distance is not None:
+                matches.append((candidate, distance))
+
+        matches.sort(key=lambda x: (x[1], x[0]))
+        return matches[:limit]
+
+    def _add_trigrams(self, term):
+        for trigram in term_trigrams(term):
+            self.trigrams.setdefault(trigram, set()).add(term)
+
+
+def term_trigrams(term):
+    padded = TRIGRAM_PADDING + term + TRIGRAM_PADDING
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def bounded_levenshtein(a, b, max_distance):
+    """
+    Расстояние Левенштейна с ранним выходом
+    :return: расстояние или None, если оно больше max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        if min(current) > max_distance:
+            return None
+        previous = current
+
+    distance = previous[-1]
+    return distance if distance <= max_distance else None
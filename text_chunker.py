@@ -0,0 +1,126 @@
+import bisect
+import re
+
+
+# Конец предложения: знак препинания и пробелы после него или перевод строки (абзацы, списки)
+_SENTENCE_END_RE = re.compile(r'[.!?…]+["»)\]]*\s+|\n+')
+
+
+def sentence_spans(text):
+    """
+    Границы предложений текста
+    :param text: исходный текст
+    :return: список (начало, конец) в символах, пробелы после предложения входят в него
+    """
+    spans = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        if match.end() > start:
+            spans.append((start, match.end()))
+            start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return [(start, end) for start, end in spans if text[start:end].strip()]
+
+
+class TokenChunker:
+    """
+    Разбивает текст на части, которые точно помещаются во вход модели.
+
+    Текст токенизируется один раз быстрым токенизатором (return_offsets_mapping),
+    по смещениям токенов считается длина каждого предложения, и предложения
+    складываются в часть, пока она не заполнит max_tokens. Предложение длиннее
+    всего окна режется по границам токенов. Части - срезы исходного текста,
+    поэтому разметка и пробелы внутри части сохраняются, а номера токенов части -
+    срезы токенизации всего текста (split_encoded).
+    """
+    def __init__(self, tokenizer, max_tokens, overlap_tokens=0):
+        if not getattr(tokenizer, 'is_fast', False):
+            raise ValueError("Для разбивки по токенам нужен быстрый токенизатор (TokenizerFast)")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)  # перекрытие соседних частей
+
+    def token_starts(self, text):
+        """
+        Начала токенов текста в символах (без служебных токенов)
+        """
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        return [start for start, end in encoding['offset_mapping'] if end > start]
+
+    def split(self, text):
+        """
+        :param text: исходный текст
+        :return: список частей текста
+        """
+        return [chunk for chunk, _ in self.split_encoded(text)]
+
+    def split_encoded(self, text):
+        """
+        То же, что split, но вместе с номерами токенов каждой части,
+        чтобы части не приходилось токенизировать заново перед моделью
+        :param text: исходный текст
+        :return: список (часть текста, номера токенов части без служебных)
+        """
+        if not text.strip():
+            return []
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        ids = list(encoding['input_ids'])
+        offsets = encoding['offset_mapping']
+        starts = [start for start, end in offsets if end > start]
+        if len(starts) <= self.max_tokens:
+            return [(text, ids)]
+
+        token_offsets = [start for start, _ in offsets]
+        encoded = []
+        for start, end in self._chunk_spans(text, starts):
+            first = bisect.bisect_left(token_offsets, start)
+            last = bisect.bisect_left(token_offsets, end)
+            encoded.append((text[start:end], ids[first:last]))
+        return encoded
+
+    def _chunk_spans(self, text, starts):
+        """
+        Границы частей текста в символах
+        :param starts: начала токенов текста
+        """
+        pieces = []  # (начало, конец, число токенов) - предложения или их куски
+        for start, end in sentence_spans(text):
+            first = bisect.bisect_left(starts, start)
+            last = bisect.bisect_left(starts, end)
+            if last - first <= self.max_tokens:
+                pieces.append((start, end, last - first))
+                continue
+            # Слишком длинное предложение режем по токенам
+            for i in range(first, last, self.max_tokens):
+                j = min(i + self.max_tokens, last)
+                piece_start = start if i == first else starts[i]
+                piece_end = end if j == last else starts[j]
+                pieces.append((piece_start, piece_end, j - i))
+
+        chunks = []
+        current = []
+        current_tokens = 0
+        for piece in pieces:
+            if current and current_tokens + piece[2] > self.max_tokens:
+                chunks.append((current[0][0], current[-1][1]))
+                current, current_tokens = self._overlap(current, piece[2])
+            current.append(piece)
+            current_tokens += piece[2]
+
+        if current:
+            chunks.append((current[0][0], current[-1][1]))
+        return chunks
+
+    def _overlap(self, pieces, next_tokens):
+        """
+        Последние предложения части, которые повторяются в начале следующей
+        """
+        kept = []
+        tokens = 0
+        for piece in reversed(pieces):
+            if tokens + piece[2] > self.overlap_tokens or tokens + piece[2] + next_tokens > self.max_tokens:
+                break
+            kept.insert(0, piece)
+            tokens += piece[2]
+        return kept, tokens
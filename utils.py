@@ -1,14 +1,46 @@
 
-import math
-from collections import defaultdict
+from collections import Counter, OrderedDict
+import hashlib
 import re
+import threading
 
 import markdown2
+import numpy as np
 from bs4 import BeautifulSoup
+from nltk.stem.snowball import SnowballStemmer
+from scipy import sparse
+
+_CYRILLIC_RE = re.compile(r'[а-яё]')
+_LATIN_RE = re.compile(r'[a-z]')
+
+_russian_stemmer = SnowballStemmer('russian')
+_english_stemmer = SnowballStemmer('english')
+_stem_cache = {}  # слово -> основа; у словаря заметок конечный размер, поэтому кэш не ограничен
+
+TOKEN_CACHE_SIZE = 1024  # сколько потоков токенов заметок держать в памяти
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# Один проход по тексту вместо цепочки re.sub: ссылки/изображения и номера
+# нумерованных списков пропускаются целиком, слова (\w+) попадают в группу 1.
+# Остальная разметка (#, *, `, маркеры списков) и знаки препинания просто не входят в слова.
+_MARKDOWN_WORDS_RE = re.compile(
+    r'!?\[.*?\]\(.*?\)'  # Ссылки и изображения
+    r'|\b\d+\.\s'  # Нумерованные списки
+    r'|(\w+)'  # Слова
+)
+
+def markdown_words(text):
+    """
+    Слова текста без Markdown разметки, за один проход предкомпилированным выражением
+    :param text: исходный текст
+    :return: список слов
+    """
+    return [word for word in _MARKDOWN_WORDS_RE.findall(text) if word]
 
 def preprocess_markdown(text):
     """
-    Очищает текст от Markdown разметки и приводит к нижнему регистру.
+    Очищает текст от Markdown разметки.
     Удаляет:
     - заголовки (#, ## и т.д.)
     - ссылки
@@ -16,93 +48,196 @@ def preprocess_markdown(text):
     - жирный/курсив
     - код
     - списки
+    :return: слова текста через пробел
     """
-    # Удаляем Markdown разметку
-    text = re.sub(r'#{1,6}\s*', '', text)  # Заголовки
-    text = re.sub(r'\!?\[.*?\]\(.*?\)', '', text)  # Ссылки и изображения
-    text = re.sub(r'\*{1,2}(.*?)\*{1,2}', r'\1', text)  # Жирный/курсив
-    text = re.sub(r'`{1,3}(.*?)`{1,3}', r'\1', text)  # Код
-    text = re.sub(r'[\-\*\+]\s+', '', text)  # Маркеры списков
-    text = re.sub(r'\d+\.\s+', '', text)  # Нумерованные списки
+    return ' '.join(markdown_words(text))
 
-    # Оставляем только буквы, цифры и пробелы
-    text = re.sub(r'[^\w\s]', ' ', text)
-    text = re.sub(r'\s+', ' ', text).strip()
+def stem(word):
+    """
+    Возвращает основу слова (Snowball: русский для кириллицы, английский для латиницы).
+    Повторное слово обходится одним обращением к словарю.
+    """
+    result = _stem_cache.get(word)
+    if result is None:
+        if _CYRILLIC_RE.search(word):
+            result = _russian_stemmer.stem(word)
+        elif _LATIN_RE.search(word):
+            result = _english_stemmer.stem(word)
+        else:
+            result = word
+        _stem_cache[word] = result
+    return result
 
-    return text
+def tokenize(text, stemming=False):
+    """
+    Разбивает текст с Markdown разметкой на слова для поискового индекса
+    :param text: исходный текст
+    :param stemming: приводить ли слова к основе
+    :return: список слов в нижнем регистре
+    """
+    # Регистр меняется у каждого слова, а не у всего текста: lower() может изменить число
+    # символов (İ -> i̇) и разбивку на слова, а слова должны совпадать с plain_text_with_offsets
+    words = [word.lower() for word in markdown_words(text)]
+    if not stemming:
+        return words
+
+    cache = _stem_cache
+    return [cache.get(word) or stem(word) for word in words]
 
-def compute_tfidf_for_search(query, documents):
+def content_hash(text):
     """
-    Вычисляет TF-IDF для поискового запроса относительно документов.
+    Хэш содержимого заметки для кэшей, привязанных к тексту
+    """
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
 
-    Аргументы:
-    ----------
-    query : str
-        Поисковый запрос (разбивается на слова по пробелам).
-    documents : list of tuple (filepath, text)
-        Список документов, где каждый документ - это (путь к файлу, текст).
+def tokenize_cached(text, stemming=False, text_hash=None):
+    """
+    То же, что tokenize, но поток токенов заметки кэшируется по хэшу содержимого,
+    поэтому повторная обработка неизменённого текста не токенизирует его заново
+    :param text_hash: уже посчитанный content_hash(text), если есть
+    """
+    key = (text_hash or content_hash(text), stemming)
+    with _token_cache_lock:
+        words = _token_cache.get(key)
+        if words is not None:
+            _token_cache.move_to_end(key)
+            return words
 
-    Возвращает:
-    -----------
-    list of tuple
-        Отсортированный список (путь к файлу, оценка релевантности) по убыванию.
+    words = tokenize(text, stemming)
+    with _token_cache_lock:
+        _token_cache[key] = words
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return words
+
+class TfidfMatrix:
     """
-    query_words = preprocess_markdown(query).split()
+    Векторизованный движок TF-IDF поиска.
 
-    # Обрабатываем документы
-    processed_docs = []
-    for filepath, text in documents:
-        processed_text = preprocess_markdown(text)
-        processed_docs.append((filepath, processed_text.split()))
+    Корпус хранится как разреженная CSR матрица термин-документ
+    с нормированным по длине документа TF. IDF терминов умножается на вектор запроса,
+    поэтому значения матрицы не зависят от числа документов корпуса.
+    Оценка запроса - одно произведение разреженного вектора запроса на матрицу
+    (затрагивает только строки терминов запроса) и argpartition для top-k.
+    """
+    def __init__(self, vocabulary, doc_ids, matrix, idf):
+        self.vocabulary = vocabulary  # термин -> номер строки
+        self.doc_ids = doc_ids  # номер столбца -> идентификатор документа
+        self.matrix = matrix  # CSR (термины x документы), значения tf
+        self.idf = idf  # IDF терминов на момент построения
+
+    @classmethod
+    def from_postings(cls, postings, doc_lengths):
+        """
+        Строит матрицу по спискам postings инвертированного индекса
+        :param postings: термин -> {документ: частота термина}
+        :param doc_lengths: документ -> число слов
+        """
+        doc_ids = list(doc_lengths)
+        doc_columns = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        lengths = np.array([doc_lengths[doc_id] for doc_id in doc_ids], dtype=np.float64)
+
+        vocabulary = {}
+        indptr = [0]
+        indices = []
+        counts = []
+        for term, term_postings in postings.items():
+            vocabulary[term] = len(vocabulary)
+            indices.extend(doc_columns[doc_id] for doc_id in term_postings)
+            counts.extend(term_postings.values())
+            indptr.append(len(indices))
 
-    # === 1. Вычисляем TF (Term Frequency) для запроса ===
-    query_tf = defaultdict(float)
-    total_words = len(query_words)
-    for word in query_words:
-        query_tf[word] += 1.0 / total_words
+        indptr = np.array(indptr, dtype=np.int64)
+        indices = np.array(indices, dtype=np.int64)
+        counts = np.array(counts, dtype=np.float64)
 
-    # === 2. Вычисляем IDF (Inverse Document Frequency) ===
-    idf = defaultdict(float)
-    total_docs = len(processed_docs) + 1
+        # Слово запроса тоже учитывается в частоте документов, как и раньше
+        doc_freq = np.diff(indptr)
+        idf = np.log((len(doc_ids) + 1) / (doc_freq + 1))
 
-    doc_freq = defaultdict(int)
+        data = counts / lengths[indices]
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(vocabulary), len(doc_ids)))
+        return cls(vocabulary, doc_ids, matrix, idf)
 
-    # Учитываем слова из документов
-    for _, words in processed_docs:
-        for word in set(words):
-            doc_freq[word] += 1
+    @classmethod
+    def from_documents(cls, documents):
+        """
+        Строит матрицу по списку документов
+        :param documents: список (идентификатор документа, текст)
+        """
+        postings = {}
+        doc_lengths = {}
+        for doc_id, text in documents:
+            words = tokenize(text)
+            doc_lengths[doc_id] = len(words)
+            for term, count in Counter(words).items():
+                postings.setdefault(term, {})[doc_id] = count
+        return cls.from_postings(postings, doc_lengths)
 
-    # Учитываем слова из запроса
-    for word in set(query_words):
-        doc_freq[word] += 1
+    def search(self, query_words, top_k=None):
+        """
+        Оценивает документы по словам запроса
+        :param query_words: список слов запроса (после tokenize)
+        :param top_k: сколько лучших документов вернуть (None - все найденные)
+        :return: список (идентификатор документа, оценка) по убыванию оценки
+        """
+        if not query_words:
+            return []
+        term_weights = {word: count / len(query_words) for word, count in Counter(query_words).items()}
+        return self.search_weighted(term_weights, top_k)
 
-    # Вычисляем IDF
-    for word, count in doc_freq.items():
-        idf[word] = math.log(total_docs / count)
+    def search_weighted(self, term_weights, top_k=None, idf=None):
+        """
+        Оценивает документы по взвешенным терминам запроса (TF запроса уже учтён в весах)
+        :param term_weights: термин -> вес
+        :param top_k: сколько лучших документов вернуть (None - все найденные)
+        :param idf: термин -> IDF, если корпус изменился после построения матрицы
+            (по умолчанию IDF на момент построения)
+        :return: список (идентификатор документа, оценка) по убыванию оценки
+        """
+        term_weights = {term: weight for term, weight in term_weights.items() if term in self.vocabulary}
+        if not term_weights or not self.doc_ids:
+            return []
 
-    # === 3. Вычисляем релевантность документов ===
-    results = []
+        rows = np.array([self.vocabulary[term] for term in term_weights], dtype=np.int64)
+        if idf is None:
+            term_idf = self.idf[rows]
+        else:
+            term_idf = np.array([idf[term] for term in term_weights], dtype=np.float64)
+        weights = np.array(list(term_weights.values()), dtype=np.float64) * term_idf
+        query_vector = sparse.csr_matrix(
+            (weights, rows, [0, len(rows)]), shape=(1, self.matrix.shape[0])
+        )
+        scores = np.asarray((query_vector @ self.matrix).todense()).ravel()
 
-    for filepath, doc_words in processed_docs:
-        # Вычисляем TF для документа
-        doc_tf = defaultdict(float)
-        doc_length = len(doc_words)
-        for word in doc_words:
-            doc_tf[word] += 1.0 / doc_length
+        found = np.flatnonzero(scores > 0)
+        if top_k is not None and top_k < len(found):
+            best = np.argpartition(-scores[found], top_k - 1)[:top_k]
+            found = found[best]
+        found = found[np.argsort(-scores[found], kind='stable')]
 
-        # Вычисляем оценку релевантности
-        score = 0.0
-        for word in set(query_words):
-            if word in doc_tf:
-                score += query_tf[word] * doc_tf[word] * idf[word]
+        return [(self.doc_ids[i], float(scores[i])) for i in found]
 
-        if score > 0:
-            results.append((filepath, score))
 
-    # Сортируем по убыванию релевантности
-    results.sort(key=lambda x: -x[1])
+def compute_tfidf_for_search(query, documents, top_k=None):
+    """
+    Вычисляет TF-IDF для поискового запроса относительно документов.
 
-    return results
+    Аргументы:
+    ----------
+    query : str
+        Поисковый запрос (разбивается на слова по пробелам).
+    documents : list of tuple (filepath, text)
+        Список документов, где каждый документ - это (путь к файлу, текст).
+    top_k : int, optional
+        Сколько лучших документов вернуть (по умолчанию все найденные).
+
+    Возвращает:
+    -----------
+    list of tuple
+        Отсортированный список (путь к файлу, оценка релевантности) по убыванию.
+    """
+    return TfidfMatrix.from_documents(documents).search(tokenize(query), top_k)
 
 def preprocess_to_html(text):
     '''